@@ -1,51 +1,87 @@
+import copy
+import os
+import uuid
+
 import streamlit as st
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
-import japanize_matplotlib
-import matplotlib.ticker as ticker
+
+from lifeplan import DECILE_RANGES, STAGE_KEYS, STAGE_NAMES, existing_housing_info, future_housing_info
+from lifeplan.timeline import NO_STAGE
+from lifeplan.cache import ResultCache, cached_compare, cached_sweep, scenario_key
+from lifeplan.core import get_table_ages
+from lifeplan.goalseek import GOAL_VARIABLES, default_bounds, get_variable, goal_seek
+from lifeplan.chart import (chart_data, chart_key, compare_chart_data, heatmap_data, render_asset_chart, render_compare_chart,
+                            render_sweep_heatmap)
+from lifeplan.adaptive import ADAPTIVE_BATCH_SIZE
+from lifeplan.jobs import JobScheduler
+from lifeplan.timing import StageTimer
+from lifeplan.parallel import CHUNK_SIZE
+from lifeplan.sampling import SAMPLING_METHODS
+from lifeplan.history import DEFAULT_BLOCK_YEARS, HISTORICAL_SERIES, available_series
+from lifeplan.models import GENERATED_MODELS, RETURN_MODELS, regime_moments
+from lifeplan.portfolio import ASSET_CORRELATIONS, ASSET_PRESETS, DEFAULT_THRESHOLD_PCT, REBALANCE_METHODS
 
 # ページ設定
 st.set_page_config(page_title="資産ライフプランシミュレーター", layout="wide")
 
 st.title("📊 資産＆ライフプラン シミュレーター")
 
-# ==========================================
-# ▼ 教育費データ（年額・万円） ▼
-# ==========================================
-EDU_COSTS = {
-    "all_public": { "kindergarten": 23, "elementary": 35, "junior_high": 54, "high_school": 52, "university": 120 },
-    "private_uni": { "kindergarten": 23, "elementary": 35, "junior_high": 54, "high_school": 52, "university": 172 },
-    "all_private": { "kindergarten": 36, "elementary": 170, "junior_high": 144, "high_school": 105, "university": 172 },
-    "vocational": { "kindergarten": 23, "elementary": 35, "junior_high": 54, "high_school": 52, "vocational_school": 130 },
-    "junior_college": { "kindergarten": 23, "elementary": 35, "junior_high": 54, "high_school": 52, "junior_college": 120 },
-    "high_school_grad": { "kindergarten": 23, "elementary": 35, "junior_high": 54, "high_school": 52 },
-    "medical_private": { "kindergarten": 36, "elementary": 170, "junior_high": 144, "high_school": 105, "medical_uni": 500 },
-    "study_abroad": { "kindergarten": 36, "elementary": 170, "junior_high": 144, "high_school": 105, "overseas_uni": 700 }
-}
-
-def get_school_stage(age, course_type):
-    if 3 <= age <= 5: return "kindergarten"
-    if 6 <= age <= 11: return "elementary"
-    if 12 <= age <= 14: return "junior_high"
-    if 15 <= age <= 17: return "high_school"
-    
-    # 18歳以降の分岐
-    if 18 <= age <= 23 and course_type == "medical_private": return "medical_uni"
-    if 18 <= age <= 21:
-        if course_type in ["all_public", "private_uni", "all_private"]: return "university"
-        if course_type == "study_abroad": return "overseas_uni"
-    if 18 <= age <= 19:
-        if course_type == "vocational": return "vocational_school"
-        if course_type == "junior_college": return "junior_college"
-        
-    return None
-
-STAGE_NAMES = {
-    "kindergarten": "幼", "elementary": "小", "junior_high": "中", 
-    "high_school": "高", "university": "大", "vocational_school": "専", "junior_college": "短",
-    "medical_uni": "医", "overseas_uni": "留"
-}
+# サーバープロセス内で全セッション共通の結果キャッシュ
+@st.cache_resource
+def get_result_cache():
+    return ResultCache(maxsize=128)
+
+# 描画済みグラフ (PNG) のキャッシュ。キーはプロットするデータのハッシュ
+@st.cache_resource
+def get_chart_cache():
+    return ResultCache(maxsize=64)
+
+# 全セッション共通のバックグラウンド実行 (CPUコア数ぶんのワーカープールにバッチ単位で公平に投入する)
+@st.cache_resource
+def get_scheduler():
+    return JobScheduler(workers=os.cpu_count() or 1)
+
+# ジョブの取り消し・順番の単位になるセッションの識別子
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
+# 結果・逆算・比較・感応度のどれかを表示したら True。表示後に入力ブロックだけで値を変えたら results_stale を立てる
+# (画面全体を実行すれば結果は入力に合わせて作り直されるので、どちらも毎回戻す)
+st.session_state.results_shown = False
+st.session_state.results_stale = False
+
+def show_table(rows):
+    # pandas は表を出すときに初めて読み込む (最初の画面表示を速くするため)
+    import pandas as pd
+    st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+
+# 計算中に暫定のグラフを更新する間隔 (秒)
+PREVIEW_INTERVAL = 0.5
+
+def run_simulation(scenario, key):
+    # 結果キャッシュになければ共有のワーカープールで計算し、バッチが終わるたびに暫定のグラフを出す。
+    # 待っている間このスレッドは眠っているだけなので、他のセッションの処理を止めない。
+    # 入力が変わって再実行されると、同じセッションの新しいジョブが前のジョブを取り消す
+    # 返り値は (結果, 段階ごとの時間)。キャッシュから返したときは計算の段階は空
+    res = get_result_cache().get(key)
+    if res is not None: return res, StageTimer()
+    job = get_scheduler().submit(st.session_state.session_id, key, scenario)
+    st.session_state.job_key = key
+    progress, preview = st.empty(), st.empty()
+    shown = 0
+    while not job.wait(PREVIEW_INTERVAL):
+        progress.progress(min(job.done_paths / job.total_paths, 1.0), text=f"計算中… {job.done_paths:,} / {job.total_paths:,}回")
+        snap = job.snapshot()
+        if snap is not None and snap["num_paths"] != shown:
+            shown = snap["num_paths"]
+            data = chart_data(snap)
+            preview.image(render_asset_chart(data), caption=f"暫定の結果（{shown:,}回時点・生存率 {100 - snap['ruin_prob']:.1f}%）", use_container_width=True)
+    progress.empty(); preview.empty()
+    st.session_state.pop("job_key", None)
+    res = job.result()
+    # seed 未指定の場合は結果が毎回変わるのでキャッシュしない
+    if scenario["seed"] is not None: get_result_cache().put(key, res)
+    return res, StageTimer().merge(job.timer)
 
 # ==========================================
 # ▼ 基本設定パネル ▼
@@ -57,6 +93,34 @@ with st.expander("▼ 基本設定（ここをタップして変更）", expande
         current_age = st.number_input("現在の年齢", 0, 100, 35, key="input_current_age")
         current_assets = st.number_input("現在の資産 (万円)", 0, 500000, 500)
         inflation_rate_pct = st.slider("インフレ率 (%)", 0.0, 5.0, 2.0, 0.1)
+        seed = st.number_input("乱数シード", 0, 2**31 - 1, 0, help="同じ入力・同じシードなら同じ結果になります（再計算も省略されます）")
+        return_opts = {m: RETURN_MODELS[m]["label"] for m in GENERATED_MODELS}
+        return_opts.update({k: f"過去リターン: {HISTORICAL_SERIES[k]}" for k in available_series()})
+        model_choice = st.selectbox("利回りのモデル", list(return_opts.keys()), format_func=lambda k: return_opts[k],
+                                    help="正規分布以外は、暴落の大きさ（t分布）・危機の年の連続（レジーム）・変動の大きい時期の連続（GARCH）を表現します。"
+                                         "過去リターンは、実際の年次リターンを数年ずつのまとまりで抽出します")
+        use_bootstrap = model_choice in HISTORICAL_SERIES
+        return_model = "bootstrap" if use_bootstrap else model_choice
+        model_params = None
+        if return_model == "student_t":
+            model_params = {"df": st.slider("自由度 (小さいほど暴落が大きい)", 3, 30, RETURN_MODELS["student_t"]["params"]["df"])}
+        elif return_model == "regime":
+            r_col1, r_col2 = st.columns(2)
+            with r_col1: to_crisis = st.slider("危機に入る確率 (%/年)", 1, 30, 10)
+            with r_col2: crisis_gap = st.slider("危機の年の利回りの差 (%)", -50, 0, -25)
+            model_params = {"to_crisis": to_crisis / 100, "crisis_gap": crisis_gap / 100}
+        elif return_model == "garch":
+            r_col1, r_col2 = st.columns(2)
+            with r_col1: garch_alpha = st.slider("α (前年の変動の影響)", 0.0, 0.5, RETURN_MODELS["garch"]["params"]["alpha"], 0.05)
+            with r_col2: garch_beta = st.slider("β (変動の持続性)", 0.0, 0.95, RETURN_MODELS["garch"]["params"]["beta"], 0.05)
+            model_params = {"alpha": garch_alpha, "beta": garch_beta}
+        if use_bootstrap:
+            block_years = st.slider("抽出するまとまり (年)", 1, 10, DEFAULT_BLOCK_YEARS, help="長いほど、好不調が続く並びがそのまま残ります")
+            st.caption("※ 想定利回り・リスクの代わりに過去リターン（からインフレ率を引いた値）を使います。")
+        elif not available_series():
+            st.caption("※ 過去リターンの系列 (data/returns/*.npy) を置くと、過去リターンのモデルも選べます。")
+        use_monthly = st.checkbox("月単位で計算する", value=False,
+                                  help="年間の収支を12か月に分けて毎月入出金し、利回りも月ごとに複利で計算します（積立の実態に近くなります）。結果は年齢ごとに表示します")
 
     with col_b2:
         mean_return_pct = st.slider("想定利回り (年率%)", 0.0, 20.0, 5.0, 0.1)
@@ -69,6 +133,12 @@ with st.expander("▼ 基本設定（ここをタップして変更）", expande
         """)
         
         risk_std_pct = st.slider("リスク (標準偏差%)", 0.0, 40.0, 15.0, 0.5)
+        if return_model == "regime":
+            # 危機の年の差が大きすぎてリスクに合わせられない組み合わせは、実行前にここで知らせる
+            try:
+                regime_moments({"mean": 0.0, "std": risk_std_pct / 100, "model_params": {**RETURN_MODELS["regime"]["params"], **model_params}})
+            except ValueError as e:
+                st.error(str(e))
         st.caption("""
         **📊 リスクの目安 (円ベース)**
         - 🇯🇵 **TOPIX**: 15% 〜 18%
@@ -77,6 +147,37 @@ with st.expander("▼ 基本設定（ここをタップして変更）", expande
         - 🏛 **NASDAQ**: 23% 〜 28%
         """)
 
+    # --- 資産配分 (ポートフォリオ) ---
+    st.markdown("---")
+    st.markdown("##### 📦 資産配分")
+    use_portfolio = st.checkbox("複数の資産に分けて運用する (ポートフォリオ)", value=False,
+                                help="資産ごとの利回り・リスク・相関と目標配分で計算します。上の想定利回り・リスクの代わりに使います")
+    portfolio = None
+    if use_portfolio:
+        pf_assets = []
+        for name, preset in ASSET_PRESETS.items():
+            a_col1, a_col2, a_col3 = st.columns(3)
+            with a_col1: weight = st.number_input(f"{preset['label']} の配分 (%)", 0, 100, 10 if name == "cash" else 30, key=f"pf_weight_{name}")
+            with a_col2: pf_mean = st.number_input(f"{preset['label']} の利回り (年率%)", -5.0, 20.0, preset["mean_return_pct"], 0.1, key=f"pf_mean_{name}")
+            with a_col3: pf_risk = st.number_input(f"{preset['label']} のリスク (%)", 0.0, 40.0, preset["risk_std_pct"], 0.5, key=f"pf_risk_{name}")
+            if weight > 0:
+                pf_assets.append({"name": name, "mean_return_pct": pf_mean, "risk_std_pct": pf_risk, "weight_pct": weight})
+        pf_col1, pf_col2 = st.columns(2)
+        with pf_col1:
+            rebalance = st.selectbox("リバランス", list(REBALANCE_METHODS.keys()), format_func=lambda m: REBALANCE_METHODS[m])
+            threshold_pct = DEFAULT_THRESHOLD_PCT
+            if rebalance == "threshold":
+                threshold_pct = st.slider("乖離の閾値 (%ポイント)", 1.0, 20.0, DEFAULT_THRESHOLD_PCT, 0.5)
+        with pf_col2:
+            pf_names = [a["name"] for a in pf_assets]
+            pf_labels = {n: ASSET_PRESETS[n]["label"] for n in pf_names}
+            withdrawal_order = st.multiselect("先に取り崩す資産 (選んだ順)", pf_names, format_func=lambda n: pf_labels[n],
+                                              help="未選択なら保有比率どおりに取り崩します。選ばなかった資産は最後に取り崩します")
+        portfolio = {"assets": pf_assets, "correlation": None, "rebalance": rebalance, "threshold_pct": threshold_pct,
+                     "withdrawal_order": withdrawal_order or None}
+        st.caption("※ 相関: " + "、".join(f"{ASSET_PRESETS[a]['label']}×{ASSET_PRESETS[b]['label']} {c:.2f}" for (a, b), c in ASSET_CORRELATIONS.items())
+                   + "（現金は他の資産と無相関）。利回りのモデルは正規分布・年単位で計算します。")
+
     # --- 住宅ローン設定 ---
     st.markdown("---")
     st.markdown("##### 🏠 住宅・ローン設定")
@@ -103,16 +204,9 @@ with st.expander("▼ 基本設定（ここをタップして変更）", expande
             # 現在の家賃
             current_rent_val = st.number_input("現在の住居費 (家賃など・年額)", 0, 1000, 120, help="この金額が、購入後に収支からプラス（節約）されます")
         
-        loan_principal = h_price - h_down
-        start_pay_age = h_age
-        end_pay_age = h_age + h_years - 1
-        
-        if loan_principal > 0:
-            r = h_rate / 100 / 12
-            n = h_years * 12
-            monthly_pmt = loan_principal * (r * (1+r)**n) / ((1+r)**n - 1) if r > 0 else loan_principal / n
-            annual_pmt = monthly_pmt * 12
-            housing_info = {"type": "future", "annual_pmt": annual_pmt, "start_age": start_pay_age, "end_age": end_pay_age, "current_rent_saved": current_rent_val}
+        housing_info = future_housing_info(h_age, h_price, h_down, h_rate, h_years, current_rent_val)
+        if housing_info["type"] != "none":
+            start_pay_age, end_pay_age, annual_pmt = housing_info["start_age"], housing_info["end_age"], housing_info["annual_pmt"]
             st.info(f"📅 **計画**: {start_pay_age}歳で購入。以降、家賃{current_rent_val}万が浮き、ローン{int(annual_pmt)}万を支払います。完済({end_pay_age}歳)後は住居費負担がなくなります。")
 
     elif housing_option == "すでに購入済み (ローン返済中)":
@@ -124,15 +218,9 @@ with st.expander("▼ 基本設定（ここをタップして変更）", expande
         with h_col2:
             h_years_remain = st.number_input("残り返済期間 (年)", 1, 50, 25)
         
-        start_pay_age = current_age
-        end_pay_age = current_age + h_years_remain - 1
-        
-        if loan_principal > 0:
-            r = h_rate / 100 / 12
-            n = h_years_remain * 12
-            monthly_pmt = loan_principal * (r * (1+r)**n) / ((1+r)**n - 1) if r > 0 else loan_principal / n
-            annual_pmt = monthly_pmt * 12
-            housing_info = {"type": "already", "annual_pmt": annual_pmt, "start_age": start_pay_age, "end_age": end_pay_age, "current_rent_saved": 0}
+        housing_info = existing_housing_info(current_age, loan_principal, h_rate, h_years_remain)
+        if housing_info["type"] != "none":
+            end_pay_age, annual_pmt = housing_info["end_age"], housing_info["annual_pmt"]
             st.info(f"📅 **計画**: {end_pay_age}歳で完済予定。以降、年間 約{int(annual_pmt):,}万円 の収支が改善します。")
 
     else:
@@ -145,19 +233,13 @@ with st.expander("▼ 基本設定（ここをタップして変更）", expande
     if use_pension:
         p_col1, p_col2 = st.columns(2)
         with p_col1:
-            pension_start_age = st.number_input("年金受給開始年齢", 60, 75, 65)
+            pension_start_age = st.number_input("年金受給開始年齢", 60, 75, 65, key="input_pension_start_age")
         with p_col2:
             pension_annual = st.number_input("世帯年金の受給額 (年額・万円)", 0, 1000, 240)
     else:
         pension_start_age = 65; pension_annual = 0
 
 
-# 計算用数値
-mean_return = mean_return_pct / 100
-risk_std = risk_std_pct / 100
-inflation_rate = inflation_rate_pct / 100
-real_mean_return = mean_return - inflation_rate
-
 st.divider()
 
 # ==========================================
@@ -191,20 +273,38 @@ def add_event():
     st.session_state.events_list.append({"age": current_age + 5, "amount": -100, "name": "新しいイベント"})
 def remove_event(index):
     st.session_state.events_list.pop(index)
+    clear_widgets("ev_age_", "ev_month_", "ev_amt_", "ev_name_")
 def add_child():
     st.session_state.children_list.append({"age": 0, "course": "private_uni"})
 def remove_child(index):
     st.session_state.children_list.pop(index)
+    clear_widgets("child_age_", "child_course_")
+def clear_widgets(*prefixes):
+    # 削除で番号がずれるので、入力欄の状態を消してリストの値から作り直させる
+    for k in [k for k in st.session_state if isinstance(k, str) and k.startswith(prefixes)]: del st.session_state[k]
+
+def sync_inputs(list_name):
+    # 入力ブロックの最後に呼ぶ。ブロックだけの再実行で件数が変わったとき (逆算・比較の選択肢が変わる) だけ、画面全体を再実行する。
+    # 値だけの変更なら画面全体は再実行せず、表示中の結果が古いことをブロック内で知らせる
+    items = st.session_state[list_name]
+    seen = st.session_state.get(f"{list_name}_seen")
+    st.session_state[f"{list_name}_seen"] = copy.deepcopy(items)
+    if seen is not None and seen != items:
+        if len(seen) != len(items): st.rerun()
+        if st.session_state.results_shown: st.session_state.results_stale = True
+    if st.session_state.results_stale:
+        st.warning("⚠️ 入力が変わったため、表示中の結果は古い内容です。「シミュレーションを実行する」を押すと更新します。")
 
 # ==========================================
 # 入力エリア
 # ==========================================
+# 期間・子供・イベントの各ブロックはフラグメントにして、入力を変えたときはそのブロックだけを再実行する。
+# 入力は session_state のリストに書き込み、シナリオは次に画面全体を実行したとき (実行ボタンなど) に作る。
 col1, col2 = st.columns(2)
 
-with col1:
-    st.subheader("1. ライフステージ収支")
-    st.info("💡 **現在の住居費（家賃やローン返済額）を含んだ**、年間の収支を入力してください。")
-    start_age_tracker = current_age
+@st.fragment
+def phase_inputs(start_age):
+    start_age_tracker = start_age
     for i, phase in enumerate(st.session_state.phases_list):
         st.markdown(f"**🔹 第{i+1}期間 ({start_age_tracker}歳 〜 )**")
         c_p1, c_p2 = st.columns([1, 1])
@@ -227,48 +327,57 @@ with col1:
     b_col1, b_col2 = st.columns(2)
     with b_col1: st.button("➕ 期間を追加", on_click=add_phase, use_container_width=True)
     with b_col2: st.button("🗑️ 最後の期間を削除", on_click=remove_phase, use_container_width=True)
+    sync_inputs("phases_list")
 
-with col2:
-    st.subheader("2. 子供の教育費 (自動計算)")
-    st.info("お子様の年齢を入れると、学費を自動で収支から引きます。")
+with col1:
+    st.subheader("1. ライフステージ収支")
+    st.info("💡 **現在の住居費（家賃やローン返済額）を含んだ**、年間の収支を入力してください。")
+    phase_inputs(current_age)
+
+course_opts = {
+    "all_public": "国公立大 (標準)", 
+    "private_uni": "私立大学 (平均)", 
+    "all_private": "すべて私立 (手厚い)", 
+    "medical_private": "私立医学部 (6年)",
+    "study_abroad": "海外大学留学 (4年)",
+    "vocational": "専門学校 (2年)", 
+    "junior_college": "短期大学 (2年)", 
+    "high_school_grad": "高校卒業まで"
+}
+
+@st.fragment
+def child_inputs():
     for i, child in enumerate(st.session_state.children_list):
         with st.container(border=True):
             c_head1, c_head2 = st.columns([2, 1])
             with c_head1: st.markdown(f"**👶 お子様 {i+1}**")
-            with c_head2:
-                if st.button("🗑️ 削除", key=f"del_child_{i}"): remove_child(i); st.rerun()
+            with c_head2: st.button("🗑️ 削除", key=f"del_child_{i}", on_click=remove_child, args=(i,))
             c_in1, c_in2 = st.columns(2)
             with c_in1:
                 new_age = st.number_input("現在の年齢", 0, 30, int(child["age"]), key=f"child_age_{i}")
                 st.session_state.children_list[i]["age"] = new_age
             with c_in2:
-                course_opts = {
-                    "all_public": "国公立大 (標準)", 
-                    "private_uni": "私立大学 (平均)", 
-                    "all_private": "すべて私立 (手厚い)", 
-                    "medical_private": "私立医学部 (6年)",
-                    "study_abroad": "海外大学留学 (4年)",
-                    "vocational": "専門学校 (2年)", 
-                    "junior_college": "短期大学 (2年)", 
-                    "high_school_grad": "高校卒業まで"
-                }
                 current_c = child["course"] if child["course"] in course_opts else "private_uni"
                 new_course = st.selectbox("進学コース", options=list(course_opts.keys()), format_func=lambda x: course_opts[x], index=list(course_opts.keys()).index(current_c), key=f"child_course_{i}")
                 st.session_state.children_list[i]["course"] = new_course
     st.button("➕ 子供を追加", on_click=add_child, use_container_width=True)
-    
-    st.divider()
-    st.subheader("3. その他のイベント・一時金")
+    sync_inputs("children_list")
+
+@st.fragment
+def event_inputs(show_month):
     for i, event in enumerate(st.session_state.events_list):
         with st.container(border=True):
             e_col1, e_col2 = st.columns([2, 1])
             with e_col1: st.markdown(f"**イベント {i+1}**")
-            with e_col2:
-                if st.button("🗑️ 削除", key=f"del_event_{i}"): remove_event(i); st.rerun()
+            with e_col2: st.button("🗑️ 削除", key=f"del_event_{i}", on_click=remove_event, args=(i,))
             e_in1, e_in2, e_in3 = st.columns([1, 1, 1.5])
             with e_in1:
                 new_age = st.number_input("年齢", min_value=0, max_value=150, value=int(event["age"]), key=f"ev_age_{i}")
                 st.session_state.events_list[i]["age"] = new_age
+                if show_month:
+                    # 月単位の計算では、その年齢の何か月目に入出金するかも指定できる
+                    new_month = st.number_input("何か月目", min_value=1, max_value=12, value=int(event.get("month", 1)), key=f"ev_month_{i}")
+                    st.session_state.events_list[i]["month"] = new_month
             with e_in2:
                 new_amt = st.number_input("金額(万円)", value=int(event["amount"]), key=f"ev_amt_{i}")
                 st.session_state.events_list[i]["amount"] = new_amt
@@ -276,249 +385,375 @@ with col2:
                 new_name = st.text_input("内容", value=event["name"], key=f"ev_name_{i}")
                 st.session_state.events_list[i]["name"] = new_name
     st.button("➕ イベントを追加", on_click=add_event, use_container_width=True)
+    sync_inputs("events_list")
+
+with col2:
+    st.subheader("2. 子供の教育費 (自動計算)")
+    st.info("お子様の年齢を入れると、学費を自動で収支から引きます。")
+    child_inputs()
+    
+    st.divider()
+    st.subheader("3. その他のイベント・一時金")
+    event_inputs(use_monthly and not use_portfolio)
 
 # ==========================================
 # シミュレーション実行
 # ==========================================
 st.divider()
-if st.button("シミュレーションを実行する (10,000回)", type="primary"):
+sim_modes = {10000: "10,000回", 100000: "100,000回", 1000000: "1,000,000回", 0: "自動 (精度目標に達したら停止)"}
+sim_mode = st.selectbox("試行回数", list(sim_modes.keys()), format_func=lambda n: sim_modes[n],
+                        help="10万回以上はチャンクに分割し、CPUコア数ぶん並列で計算します")
+use_adaptive = sim_mode == 0
+adaptive_settings = None
+if use_adaptive:
+    a_col1, a_col2 = st.columns(2)
+    with a_col1:
+        survival_pp = st.number_input("生存率の精度目標 (± %ポイント)", 0.1, 5.0, 0.5, 0.1)
+    with a_col2:
+        median_pct = st.number_input("中央値の精度目標 (± %)", 0.5, 20.0, 2.0, 0.5)
+    adaptive_settings = {"survival_pp": survival_pp, "median_pct": median_pct, "confidence": 0.95}
+    st.caption(f"※ {ADAPTIVE_BATCH_SIZE:,}回ずつ追加し、95%信頼区間が目標に収まった時点で停止します（上限 1,000,000回）。")
+num_simulations = 1000000 if use_adaptive else sim_mode
+v_col1, v_col2 = st.columns(2)
+with v_col1:
+    sampling = st.selectbox("乱数の引き方 (分散低減)", list(SAMPLING_METHODS.keys()), format_func=lambda m: SAMPLING_METHODS[m],
+                            help="同じ精度をより少ない試行回数で得るための工夫です。効果は結果の下に「分散低減率」として表示します",
+                            disabled=return_model != "normal" or use_portfolio)
+with v_col2:
+    control_variate = st.checkbox("制御変量で補正する", value=False,
+                                  help="単純計算の推移など、期待値が計算で分かる量とのずれを使って推定値のばらつきを抑えます",
+                                  disabled=return_model != "normal" or use_portfolio)
+# 分散低減の乱数の引き方は正規分布だけ、制御変量は年の間に相関がないモデルだけで使える
+if return_model != "normal" or use_portfolio: sampling = "plain"
+if not RETURN_MODELS[return_model]["control_variate"] or use_portfolio: control_variate = False
+t_col1, t_col2 = st.columns(2)
+with t_col1:
+    extra_percentiles = st.multiselect("グラフに追加するパーセンタイル", [5, 10, 25, 75, 90, 95], default=[],
+                                       help="中央値 (50%) と上位・下位20% は常に表示します")
+with t_col2:
+    table_steps = {10: "10歳刻み", 5: "5歳刻み", 1: "毎年"}
+    table_step = st.selectbox("分布表の刻み", list(table_steps.keys()), format_func=lambda n: table_steps[n])
+show_diagnostics = st.checkbox("処理時間を表示する (診断用)", value=False, help="計算・グラフ描画・表の作成にかかった時間を段階ごとに表示します")
+# 10万回以上はチャンクごとに独立した乱数列を使い、チャンクごとにワーカーへ分けて並列実行する
+use_parallel = num_simulations > 10000
+# 100万回はパス行列を持たずに年別ヒストグラムで集計する (メモリ一定)
+use_stream = num_simulations >= 1000000
+if use_stream:
+    st.caption("※ 100万回（自動を含む）は省メモリ集計のため、中央値・分布表は近似値です（誤差 1% 未満、生存率は厳密）。")
+
+scenario = {
+    "current_age": current_age,
+    "current_assets": current_assets,
+    "inflation_rate_pct": inflation_rate_pct,
+    "mean_return_pct": mean_return_pct,
+    "risk_std_pct": risk_std_pct,
+    "housing_info": housing_info,
+    "use_pension": use_pension,
+    "pension_start_age": pension_start_age,
+    "pension_annual": pension_annual,
+    "phases_list": st.session_state.phases_list,
+    "children_list": st.session_state.children_list,
+    "events_list": st.session_state.events_list,
+    "num_simulations": num_simulations,
+    "seed": seed,
+    "chunk_size": ADAPTIVE_BATCH_SIZE if use_adaptive else CHUNK_SIZE if use_parallel else None,
+    "aggregation": "stream" if use_stream else "exact",
+    "adaptive": adaptive_settings,
+    "sampling": sampling,
+    "control_variate": control_variate,
+    "return_model": "normal" if use_portfolio else return_model,
+    "model_params": None if use_portfolio else model_params,
+    "history_series": model_choice if use_bootstrap else "sp500",
+    "block_years": block_years if use_bootstrap else DEFAULT_BLOCK_YEARS,
+    "portfolio": portfolio,
+    "time_step": "month" if use_monthly and not use_portfolio else "year",
+    "percentiles": sorted({20, 50, 80, *extra_percentiles}),
+    # 分布表は毎年分を計算しておき、表示の刻みは描画時に選ぶ (刻みを変えても再計算しない)
+    "table_step": 1,
+}
+result_key = scenario_key(scenario)
+
+# 入力が変わって計算中のジョブが要らなくなったら、共有のワーカープールを空けるためにすぐ取り消す
+# (待っている間に再実行されると、run_simulation は job_key を残したまま中断される)
+if st.session_state.get("job_key") not in (None, result_key):
+    get_scheduler().cancel(st.session_state.session_id)
+    del st.session_state.job_key
+
+# 実行後の再描画でも、入力が変わっていなければ前回の結果を表示し続ける
+if st.button(f"シミュレーションを実行する ({'自動' if use_adaptive else f'{num_simulations:,}回'})", type="primary"):
+    st.session_state.result_key = result_key
+if st.session_state.get("result_key") == result_key:
+    st.session_state.results_shown = True
     try:
-        end_age = st.session_state.phases_list[-1]["end"] if st.session_state.phases_list else 100
-        years = end_age - current_age
+        res, timings = run_simulation(scenario, result_key)
+        timeline = res["timeline"]
+        deterministic_assets = res["deterministic"]
+        principal_assets = res["principal"]
+        median_res, top_20_res, bottom_20_res = res["median"], res["top_20"], res["bottom_20"]
+        ruin_prob = res["ruin_prob"]
+        end_age = int(res["end_age"])   # 入力の検証 (終了年齢など) は計算の準備 (core.prepare_run) で行う
+
+        st.subheader(f"シミュレーション結果 ({end_age}歳まで)")
         
-        if years <= 0:
-            st.error(f"エラー：終了年齢({end_age}歳)は、現在の年齢({current_age}歳)より未来に設定してください。")
-        else:
-            num_simulations = 10000 
-            
-            # 1. 基本収支マップ
-            cashflow_map = {}
-            temp_start = current_age
-            for p in st.session_state.phases_list:
-                end_val = int(p["end"])
-                amount_val = int(p["amount"])
-                if temp_start <= end_val:
-                    for age in range(temp_start, end_val + 1):
-                        cashflow_map[age] = amount_val
-                temp_start = end_val + 1
-
-            # 2. 教育費の控除
-            education_cost_map = {}
-            for child in st.session_state.children_list:
-                c_age = child["age"]
-                c_course = child["course"]
-                for y in range(40): 
-                    current_c_age = c_age + y
-                    parent_age = current_age + y
-                    if parent_age > end_age: break
-                    stage = get_school_stage(current_c_age, c_course)
-                    if stage:
-                        cost = EDU_COSTS[c_course][stage]
-                        cashflow_map[parent_age] = cashflow_map.get(parent_age, 0) - cost
-                        education_cost_map[parent_age] = education_cost_map.get(parent_age, 0) + cost
-
-            # 3. 年金 & 住宅ローン
-            for y in range(years + 1):
-                age = current_age + y
-                
-                if use_pension and age >= pension_start_age:
-                    cashflow_map[age] = cashflow_map.get(age, 0) + pension_annual
-                
-                if housing_info["type"] == "already":
-                    if age > housing_info["end_age"]:
-                        cashflow_map[age] = cashflow_map.get(age, 0) + housing_info["annual_pmt"]
-                
-                elif housing_info["type"] == "future":
-                    if age >= housing_info["start_age"]:
-                        cashflow_map[age] = cashflow_map.get(age, 0) + housing_info["current_rent_saved"]
-                        if age <= housing_info["end_age"]:
-                            cashflow_map[age] = cashflow_map.get(age, 0) - housing_info["annual_pmt"]
-
-            # 4. イベントマップ
-            event_map = {}
-            for e in st.session_state.events_list:
-                event_map[int(e["age"])] = event_map.get(int(e["age"]), 0) + int(e["amount"])
-            
-            # --- シミュレーション計算 ---
-            deterministic_assets = [current_assets]
-            principal_assets = [current_assets]
-            simulation_results = np.zeros((num_simulations, years + 1))
-            
-            for year in range(years):
-                age = current_age + year
-                flow = cashflow_map.get(age, 0)
-                spot = event_map.get(age, 0)
-                
-                prev_d = deterministic_assets[-1]
-                if prev_d <= 0: new_d = 0
-                else:
-                    new_d = (prev_d + flow + spot) * (1 + real_mean_return)
-                    if new_d < 0: new_d = 0
-                deterministic_assets.append(new_d)
-                
-                prev_p = principal_assets[-1]
-                new_p = prev_p + flow + spot
-                if new_p < 0: new_p = 0
-                principal_assets.append(new_p)
-
-            # C: モンテカルロ
-            progress_bar = st.progress(0)
-            for i in range(num_simulations):
-                assets = [current_assets]
-                if i % 100 == 0: progress_bar.progress(i / num_simulations)
-                for year in range(years):
-                    age = current_age + year
-                    flow = cashflow_map.get(age, 0)
-                    spot = event_map.get(age, 0)
-                    r = np.random.normal(real_mean_return, risk_std)
-                    prev = assets[-1]
-                    if prev <= 0: new_val = 0
-                    else:
-                        new_val = (prev + flow + spot) * (1 + r)
-                        if new_val < 0: new_val = 0
-                    assets.append(new_val)
-                simulation_results[i, :] = assets
-            progress_bar.progress(1.0)
-
-            # --- 結果集計 ---
-            median_res = np.percentile(simulation_results, 50, axis=0)
-            top_20_res = np.percentile(simulation_results, 80, axis=0)
-            bottom_20_res = np.percentile(simulation_results, 20, axis=0)
-            ruin_prob = (np.sum(simulation_results[:, -1] == 0) / num_simulations) * 100
-
-            st.subheader(f"シミュレーション結果 ({end_age}歳まで)")
-            
-            total_edu = sum(education_cost_map.values())
-            if total_edu > 0: st.info(f"🎓 **教育費**: 総額 約 {total_edu:,} 万円 を考慮済")
-            if use_pension: st.success(f"👴 **年金**: {pension_start_age}歳から年額 {pension_annual:,} 万円 を加算済")
-            if housing_info["type"] != "none":
-                total_loan = housing_info["annual_pmt"] * (housing_info["end_age"] - housing_info["start_age"] + 1)
-                st.warning(f"🏠 **住宅ローン**: {housing_info['start_age']}歳〜{housing_info['end_age']}歳まで返済。完済後は収支が改善します。")
-
-            with st.expander("🔰 数字の見方ガイド", expanded=True):
-                st.markdown("""
-                * **生存率**: 資産が底をつかない確率。80%以上が目安。
-                * **好調/不調**: **上位20%** と **下位20%** のラインを表示。
-                * **積立元本(グレー)**: 投資をせず、貯金だけで推移した場合の金額。
-                """)
-
-            c1, c2, c3, c4 = st.columns(4)
-            c1.metric(f"{end_age}歳生存率", f"{100 - ruin_prob:.1f}%")
-            c2.metric("単純計算", f"{int(deterministic_assets[-1]):,}万")
-            c3.metric("中央値", f"{int(median_res[-1]):,}万")
-            c4.metric("不調時 (下位20%)", f"{int(bottom_20_res[-1]):,}万")
-
-            # グラフ
-            fig, ax = plt.subplots(figsize=(10, 6))
-            age_axis = np.arange(current_age, end_age + 1)
-            
-            for age, cost in education_cost_map.items():
-                if cost > 0: ax.axvspan(age, age+1, color='cyan', alpha=0.1)
-            
-            for y in range(years):
-                age = current_age + y
-                flow = cashflow_map.get(age, 0)
-                if flow < 0: ax.axvspan(age, age+1, color='orange', alpha=0.1)
-                
-                if housing_info["type"] != "none":
-                    if housing_info["start_age"] <= age <= housing_info["end_age"]:
-                         ax.axvspan(age, age+1, ymin=0, ymax=0.05, color='purple', alpha=0.5)
-
-            ax.plot(age_axis, principal_assets, color='gray', linewidth=2, linestyle='-', label='積立元本')
-            ax.plot(age_axis, deterministic_assets, color='orange', linewidth=3, linestyle=':', label='単純計算')
-            ax.plot(age_axis, median_res, color='blue', linewidth=2, label='中央値')
-            ax.plot(age_axis, top_20_res, color='green', linestyle='--', linewidth=1, label='好調 (上位20%)')
-            ax.plot(age_axis, bottom_20_res, color='red', linestyle='--', linewidth=1, label='不調 (下位20%)')
-            
-            ax.set_title("資産推移", fontsize=14)
-            ax.set_xlabel("年齢")
-            ax.set_ylabel("資産額 (万円)")
-            ax.legend()
-            ax.grid(True, linestyle='--', alpha=0.7)
-            ax.yaxis.set_major_formatter(ticker.FuncFormatter(lambda x, p: f'{int(x):,}'))
-            st.pyplot(fig)
-            
-            st.caption("※ グラフ背景の色について：")
-            st.caption("🟦 **水色**: 教育費がかかる期間")
-            st.caption("🟧 **オレンジ**: 収支が赤字（貯金取崩し）の期間")
-            st.caption("🟩 **緑色**: 上記2つが重なっている期間（教育費負担があり、かつ赤字の期間）")
-            st.caption("🟪 **紫の帯(下部)**: 住宅ローン返済期間")
+        total_edu = int(timeline["edu_total"].sum())
+        if total_edu > 0: st.info(f"🎓 **教育費**: 総額 約 {total_edu:,} 万円 を考慮済")
+        if use_pension: st.success(f"👴 **年金**: {pension_start_age}歳から年額 {pension_annual:,} 万円 を加算済")
+        if housing_info["type"] != "none":
+            total_loan = housing_info["annual_pmt"] * (housing_info["end_age"] - housing_info["start_age"] + 1)
+            st.warning(f"🏠 **住宅ローン**: {housing_info['start_age']}歳〜{housing_info['end_age']}歳まで返済。完済後は収支が改善します。")
+
+        with st.expander("🔰 数字の見方ガイド", expanded=True):
+            st.markdown("""
+            * **生存率**: 資産が底をつかない確率。80%以上が目安。
+            * **好調/不調**: **上位20%** と **下位20%** のラインを表示。
+            * **積立元本(グレー)**: 投資をせず、貯金だけで推移した場合の金額。
+            """)
+
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric(f"{end_age}歳生存率", f"{100 - ruin_prob:.1f}%")
+        c2.metric("単純計算", f"{int(deterministic_assets[-1]):,}万")
+        c3.metric("中央値", f"{int(median_res[-1]):,}万")
+        c4.metric("不調時 (下位20%)", f"{int(bottom_20_res[-1]):,}万")
+        s_lo, s_hi = res["survival_ci"]
+        m_lo, m_hi = res["median_ci"]
+        stop_note = "" if res["converged"] is None else ("・精度目標に到達" if res["converged"] else "・上限に到達")
+        vr = res["variance_reduction"]
+        if sampling != "plain" or control_variate:
+            fmt_vr = lambda v: "-" if v is None else f"×{v:.1f}"
+            st.caption(f"🎯 分散低減率 (通常の乱数との比較): 生存率 {fmt_vr(vr['survival'])} ／ 最終資産の平均 {fmt_vr(vr['mean_final'])}（平均 {int(res['mean_final']):,}万）")
+        st.caption(f"📏 {res['confidence']:.0%}信頼区間 — 生存率: {s_lo:.1f}% 〜 {s_hi:.1f}% ／ 中央値: {int(m_lo):,}万 〜 {int(m_hi):,}万 （試行 {res['num_paths']:,}回{stop_note}）")
+
+        # グラフ (同じデータなら描画済みの画像を再利用)
+        with timings.measure("chart"):
+            data = chart_data(res)
+            png = get_chart_cache().get_or_compute(chart_key(data), lambda: render_asset_chart(data))
+            st.image(png, use_container_width=True)
+        
+        st.caption("※ グラフ背景の色について：")
+        st.caption("🟦 **水色**: 教育費がかかる期間")
+        st.caption("🟧 **オレンジ**: 収支が赤字（貯金取崩し）の期間")
+        st.caption("🟩 **緑色**: 上記2つが重なっている期間（教育費負担があり、かつ赤字の期間）")
+        st.caption("🟪 **紫の帯(下部)**: 住宅ローン返済期間")
 
-            st.divider()
-            
-            # --- 表1: 資産額分布 (10歳刻み) ---
-            st.subheader("📋 詳細データ: 資産額の分布 (10歳刻み)")
-            step = 10
-            t_ages = list(range(current_age, end_age + 1, step))
-            if t_ages[-1] != end_age: t_ages.append(end_age)
-            
-            ranges = [
-                (90, 100, "上位 10%"), (80, 90, "11% - 20%"), (70, 80, "21% - 30%"), (60, 70, "31% - 40%"),
-                (50, 60, "41% - 50% (中央)"), (40, 50, "51% - 60%"), (30, 40, "61% - 70%"), (20, 30, "71% - 80%"),
-                (10, 20, "81% - 90%"), (0, 10, "91% - 100% (下位)")
-            ]
-            
-            d_data = {"ランク": [r[2] for r in ranges]}
+        st.divider()
+        
+        # --- 表1: 資産額分布 ---
+        st.subheader(f"📋 詳細データ: 資産額の分布 ({table_steps[table_step]})")
+        t_ages = get_table_ages(current_age, end_age, table_step)
+        
+        with timings.measure("table"):
+            d_data = {"ランク": [r[2] for r in DECILE_RANGES]}
             r_data = {"指標": ["単純計算", "積立元本"]}
 
             for ta in t_ages:
                 col = f"{ta}歳"
                 idx = ta - current_age
-                vals = np.sort(simulation_results[:, idx])
-                col_vals = []
-                for s, e, _ in ranges:
-                    idx_s, idx_e = int(num_simulations * s / 100), int(num_simulations * e / 100)
-                    subset = vals[idx_s:idx_e]
-                    avg = np.mean(subset) if len(subset) > 0 else 0
-                    col_vals.append(f"{int(avg):,} 万円")
-                d_data[col] = col_vals
-                
+                d_data[col] = [f"{int(avg):,} 万円" for avg in res["decile_table"][:, idx]]
+            
                 c_vals = []
                 c_vals.append(f"{int(deterministic_assets[idx]):,} 万円" if idx < len(deterministic_assets) else "-")
                 c_vals.append(f"{int(principal_assets[idx]):,} 万円" if idx < len(principal_assets) else "-")
                 r_data[col] = c_vals
 
-            st.dataframe(pd.DataFrame(d_data), hide_index=True, use_container_width=True)
+            show_table(d_data)
             st.caption("👇 比較用データ")
-            st.dataframe(pd.DataFrame(r_data), hide_index=True, use_container_width=True)
+            show_table(r_data)
 
-            # --- 表2: 教育費内訳 ---
-            st.divider()
-            st.subheader("🎓 教育費の内訳詳細")
+        # --- 表2: 教育費内訳 ---
+        st.divider()
+        st.subheader("🎓 教育費の内訳詳細")
+        with timings.measure("table"):
             edu_rows = []
-            grand_total = 0
-            c_totals = [0]*len(st.session_state.children_list)
-
-            for y in range(years + 1):
-                p_age = current_age + y
-                y_tot = 0
-                row = {"親の年齢": f"{p_age}歳"}
-                has = False
-                for i, child in enumerate(st.session_state.children_list):
-                    c_age = child["age"] + y
-                    stg = get_school_stage(c_age, child["course"])
-                    if stg:
-                        cost = EDU_COSTS[child["course"]][stg]
-                        y_tot += cost
-                        c_totals[i] += cost
-                        grand_total += cost
-                        sn = STAGE_NAMES.get(stg, stg)
-                        row[f"子供{i+1}"] = f"{c_age}歳({sn}): {cost}万"
-                        has = True
+            edu_stage, edu_cost, child_age = timeline["edu_stage"], timeline["edu_cost"], timeline["child_age"]
+            c_totals = edu_cost.sum(axis=1)
+            grand_total = int(c_totals.sum())
+
+            for y in np.nonzero((edu_stage != NO_STAGE).any(axis=0))[0]:
+                row = {"親の年齢": f"{timeline['ages'][y]}歳"}
+                for i in range(len(edu_stage)):
+                    if edu_stage[i, y] != NO_STAGE:
+                        sn = STAGE_NAMES[STAGE_KEYS[edu_stage[i, y]]]
+                        row[f"子供{i+1}"] = f"{child_age[i, y]}歳({sn}): {edu_cost[i, y]}万"
                     else:
                         row[f"子供{i+1}"] = "-"
-                if has:
-                    row["教育費合計"] = f"▲{y_tot}万円"
-                    edu_rows.append(row)
-            
+                row["教育費合計"] = f"▲{timeline['edu_total'][y]}万円"
+                edu_rows.append(row)
+        
             if edu_rows:
                 total_row = {"親の年齢": "合計"}
                 for i, t in enumerate(c_totals): total_row[f"子供{i+1}"] = f"{t:,}万円"
                 total_row["教育費合計"] = f"{grand_total:,}万円"
                 edu_rows.append(total_row)
-                st.dataframe(pd.DataFrame(edu_rows), hide_index=True, use_container_width=True)
+                show_table(edu_rows)
             else:
                 st.info("教育費がかかる期間はありません。")
 
+        # --- 処理時間 (診断) ---
+        timings.log(num_paths=int(res["num_paths"]), years=int(res["years"]), aggregation=scenario["aggregation"],
+                    children=len(scenario["children_list"]), events=len(scenario["events_list"]), cached=not timings.seconds.get("monte_carlo"))
+        if show_diagnostics:
+            with st.expander("⏱ 処理時間 (診断)", expanded=True):
+                show_table([{"段階": label, "時間 (ms)": round(sec * 1000, 1), "回数": calls} for _, label, sec, calls in timings.rows()])
+                st.caption(f"合計 {timings.total() * 1000:,.0f} ms。モンテカルロはワーカーでの待ち時間を含みます。"
+                           + ("結果はキャッシュから表示したので、計算の段階は含みません。" if not timings.seconds.get("monte_carlo") else ""))
+
+    except Exception as e:
+        st.error(f"エラー: {e}")
+
+# ==========================================
+# 目標生存率から逆算 (ゴールシーク)
+# ==========================================
+st.divider()
+st.subheader("🎯 目標の生存率から逆算")
+st.caption("1つの項目だけを動かし、生存率が目標ちょうどになる値を探します。同じ乱数の上で、収支が変わる年以降だけを計算し直します。")
+goal_vars = [v for v in GOAL_VARIABLES if v != "pension_start_age" or use_pension]
+if len(st.session_state.phases_list) < 2: goal_vars.remove("phase_end")
+if not st.session_state.events_list: goal_vars.remove("event_amount")
+g_col1, g_col2, g_col3 = st.columns(3)
+with g_col1:
+    goal_target = st.slider("目標の生存率 (%)", 50, 99, 80)
+with g_col2:
+    goal_var = st.selectbox("動かす項目", goal_vars, format_func=lambda v: GOAL_VARIABLES[v])
+with g_col3:
+    if goal_var in ("phase_amount", "phase_end"):
+        # 最後の期間の終了年齢はシミュレーション期間そのものなので選べない
+        n_phase = len(st.session_state.phases_list) - (goal_var == "phase_end")
+        goal_index = st.selectbox("対象の期間", range(n_phase), format_func=lambda i: f"第{i+1}期間", index=n_phase - 1)
+    elif goal_var == "event_amount":
+        event_names = [e["name"] for e in st.session_state.events_list]
+        goal_index = st.selectbox("対象のイベント", range(len(event_names)), format_func=lambda i: f"イベント{i+1}: {event_names[i]}")
+    else:
+        goal_index = None
+
+goal_scenario = {**scenario, "num_simulations": 10000, "chunk_size": None, "aggregation": "exact", "adaptive": None}
+goal_key = scenario_key({**goal_scenario, "goal": [goal_var, goal_index, goal_target]})
+
+def apply_goal(variable, index, value):
+    # 見つかった値を入力に反映する (ウィジェットの状態を消して、新しい値で作り直させる)
+    if variable == "phase_amount":
+        st.session_state.phases_list[index]["amount"] = value; st.session_state.pop(f"phase_amount_{index}", None)
+    elif variable == "phase_end":
+        st.session_state.phases_list[index]["end"] = value; st.session_state.pop(f"phase_end_{index}", None)
+    elif variable == "event_amount":
+        st.session_state.events_list[index]["amount"] = value; st.session_state.pop(f"ev_amt_{index}", None)
+    else:
+        st.session_state["input_pension_start_age"] = value
+
+if st.button("逆算する"):
+    st.session_state.goal_key = goal_key
+if st.session_state.get("goal_key") == goal_key:
+    st.session_state.results_shown = True
+    try:
+        goal = get_result_cache().get_or_compute(goal_key, lambda: goal_seek(goal_scenario, goal_var, goal_target, goal_index))
+        lo, hi = goal["bounds"]
+        label = GOAL_VARIABLES[goal_var]
+        if goal["status"] == "ok":
+            st.success(f"**{label}**: **{goal['value']:,}** で生存率 {goal['survival']:.1f}%（目標 {goal_target}% を満たす境目）")
+        elif goal["status"] == "always":
+            st.info(f"探索範囲 {lo:,} 〜 {hi:,} のどの値でも目標 {goal_target}% を満たします（{goal['value']:,} で生存率 {goal['survival']:.1f}%）。")
+        else:
+            st.warning(f"探索範囲 {lo:,} 〜 {hi:,} では目標 {goal_target}% に届きません（最も良い {goal['value']:,} で生存率 {goal['survival']:.1f}%）。")
+        st.caption(f"※ 試行 {goal['num_paths']:,}回・{len(goal['evaluations'])}回の評価で探索しました。")
+        if goal["status"] == "ok" and goal["value"] != get_variable(scenario, goal_var, goal_index):
+            st.button("この値を入力に反映する", on_click=apply_goal, args=(goal_var, goal_index, goal["value"]))
+    except Exception as e:
+        st.error(f"エラー: {e}")
+
+# ==========================================
+# プランの比較
+# ==========================================
+st.divider()
+st.subheader("⚖️ プランの比較")
+st.caption("現在の設定から住居・進学コース・退職の時期などを変えたプランを、すべて同じ乱数でまとめて計算して重ねます。差は乱数のばらつきではなく、プランの違いだけを表します。")
+n_plans = st.selectbox("比較するプランの数 (現在の設定を含む)", [2, 3, 4])
+cmp_phases = st.session_state.phases_list
+cmp_children = st.session_state.children_list
+cmp_variants = [{"name": "現在の設定", "changes": {}}]
+for k in range(1, n_plans):
+    with st.container(border=True):
+        changes = {}
+        v_col1, v_col2, v_col3, v_col4 = st.columns(4)
+        with v_col1:
+            plan_name = st.text_input("プラン名", f"プラン{k + 1}", key=f"cmp_name_{k}")
+            if st.selectbox("住居", ["現在の設定", "考慮しない (賃貸のまま)"], key=f"cmp_housing_{k}") != "現在の設定":
+                changes["housing_info"] = {"type": "none"}
+        with v_col2:
+            cmp_course = st.selectbox("子供の進学コース (全員)", ["current"] + list(course_opts.keys()), key=f"cmp_course_{k}",
+                                      format_func=lambda c: "現在の設定" if c == "current" else course_opts[c], disabled=not cmp_children)
+            if cmp_course != "current" and cmp_children:
+                changes["children_list"] = [{**c, "course": cmp_course} for c in cmp_children]
+        with v_col3:
+            # 期間の終了年齢を動かす (例: 働く期間の終わり = 退職年齢)
+            cmp_phase = st.selectbox("終了年齢を変える期間", [None] + list(range(len(cmp_phases) - 1)), key=f"cmp_phase_{k}",
+                                     format_func=lambda i: "変えない" if i is None else f"第{i + 1}期間")
+            if cmp_phase is not None:
+                p_lo, p_hi = default_bounds(scenario, "phase_end", cmp_phase)
+                new_end = st.number_input("終了年齢", p_lo, max(p_lo, p_hi), min(max(int(cmp_phases[cmp_phase]["end"]), p_lo), max(p_lo, p_hi)), key=f"cmp_end_{k}")
+                changes["phases_list"] = [{**p, "end": new_end} if i == cmp_phase else p for i, p in enumerate(cmp_phases)]
+        with v_col4:
+            if use_pension:
+                cmp_pension = st.number_input("年金受給開始年齢", 60, 75, pension_start_age, key=f"cmp_pension_{k}")
+                if cmp_pension != pension_start_age: changes["pension_start_age"] = cmp_pension
+        cmp_variants.append({"name": plan_name, "changes": changes})
+
+compare_scenario = {**scenario, "num_simulations": 10000, "chunk_size": None, "aggregation": "exact", "adaptive": None}
+compare_key = scenario_key({**compare_scenario, "compare_variants": cmp_variants})
+if st.button("プランを比較する"):
+    st.session_state.compare_key = compare_key
+if st.session_state.get("compare_key") == compare_key:
+    st.session_state.results_shown = True
+    try:
+        comparison = cached_compare(compare_scenario, cmp_variants, get_result_cache())
+        data = compare_chart_data(comparison)
+        png = get_chart_cache().get_or_compute(chart_key(data), lambda: render_compare_chart(data))
+        st.image(png, use_container_width=True)
+        cmp_rows = []
+        for j, v in enumerate(comparison["variants"]):
+            d_lo, d_hi = v["survival_diff_ci"]
+            cmp_rows.append({
+                "プラン": v["name"],
+                "生存率": f"{v['survival']:.1f}% ({v['end_age']}歳)",
+                "基準との差": "基準" if j == 0 else f"{v['survival_diff']:+.1f}pt ({d_lo:+.1f} 〜 {d_hi:+.1f})",
+                "最終資産 (中央値)": f"{int(v['median'][-1]):,} 万円",
+                "不調時 (下位20%)": f"{int(v['bottom_20'][-1]):,} 万円",
+                "単純計算": f"{int(v['deterministic'][-1]):,} 万円",
+            })
+        show_table(cmp_rows)
+        st.caption(f"※ 各プラン {comparison['num_paths']:,}回・共通の乱数で計算。基準との差の括弧内は {comparison['confidence']:.0%}信頼区間です（同じ乱数どうしの対で求めるので、別々に計算するより狭くなります）。")
+    except Exception as e:
+        st.error(f"エラー: {e}")
+
+# ==========================================
+# 感応度分析 (利回り × リスク)
+# ==========================================
+st.divider()
+st.subheader("🔥 感応度分析: 利回り × リスク")
+st.caption("利回り・リスクを少しずつ変えた組み合わせを、すべて同じ乱数でまとめて計算します。隣のマスとの差は条件の違いだけを表します。（1つの資産・正規分布・年単位で計算します）")
+h_col1, h_col2, h_col3 = st.columns(3)
+with h_col1:
+    sweep_mean = st.slider("利回りの範囲 (年率%)", 0.0, 20.0, (max(mean_return_pct - 4, 0.0), min(mean_return_pct + 4, 20.0)), 0.5)
+    sweep_risk = st.slider("リスクの範囲 (標準偏差%)", 0.0, 40.0, (max(risk_std_pct - 10, 0.0), min(risk_std_pct + 10, 40.0)), 0.5)
+with h_col2:
+    sweep_size = st.selectbox("分割数 (各軸)", [10, 20], index=1)
+    sweep_paths = st.selectbox("試行回数 (各マス)", [2000, 10000], index=1, format_func=lambda n: f"{n:,}回")
+with h_col3:
+    sweep_infl = st.multiselect("インフレ率 (%)", sorted({0.0, 1.0, 2.0, 3.0, inflation_rate_pct}), default=[inflation_rate_pct])
+
+sweep_axes = (np.linspace(*sweep_mean, sweep_size).tolist(), np.linspace(*sweep_risk, sweep_size).tolist(), sorted(sweep_infl) or [inflation_rate_pct])
+sweep_scenario = {**scenario, "return_model": "normal", "model_params": None, "portfolio": None, "time_step": "year", "num_simulations": sweep_paths, "chunk_size": None, "aggregation": "exact", "adaptive": None}
+sweep_run_key = scenario_key({**sweep_scenario, "sweep_axes": sweep_axes})
+if st.button(f"感応度を計算する ({sweep_size}×{sweep_size}マス)"):
+    st.session_state.sweep_key = sweep_run_key
+if st.session_state.get("sweep_key") == sweep_run_key:
+    st.session_state.results_shown = True
+    try:
+        sweep = {**cached_sweep(sweep_scenario, sweep_axes, get_result_cache()), "marker": [mean_return_pct, risk_std_pct]}
+        tabs = st.tabs([f"インフレ率 {v:g}%" for v in sweep["inflations_pct"]])
+        for k, tab in enumerate(tabs):
+            with tab:
+                data = heatmap_data(sweep, k)
+                png = get_chart_cache().get_or_compute(chart_key(data), lambda: render_sweep_heatmap(data))
+                st.image(png, use_container_width=True)
+        st.caption(f"※ ★ は現在の設定、黒線は生存率80%の境目です（{sweep['end_age']}歳時点・各マス {sweep['num_paths']:,}回）。")
     except Exception as e:
         st.error(f"エラー: {e}")
@@ -0,0 +1,15 @@
+from .core import (
+    DECILE_RANGES,
+    DEFAULT_SCENARIO,
+    EDU_COSTS,
+    STAGE_NAMES,
+    existing_housing_info,
+    future_housing_info,
+    get_end_age,
+    get_school_stage,
+    loan_annual_payment,
+    normalize_scenario,
+    simulate,
+    summary_metrics,
+)
+from .timeline import STAGE_KEYS, compile_timeline
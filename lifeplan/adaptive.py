@@ -0,0 +1,65 @@
+import numpy as np
+
+from .core import simulate_chunk, split_chunks
+from .sketch import PathSketch
+from .stats import precision_met, precision_summary
+
+# ==========================================
+# ▼ 精度目標で止まる適応的モンテカルロ ▼
+# ==========================================
+# バッチごとにパスを追加し、生存率と最終年齢の中央値の信頼区間が目標幅に
+# 収まった時点で打ち切る。num_simulations は試行回数の上限 (予算) として扱う。
+# バッチ i の乱数列は chunk_rng(seed, i) で固定、停止判定もバッチ順に行うので、
+# 使用パス数と結果はワーカー数によらず一致する。
+
+ADAPTIVE_BATCH_SIZE = 5000
+
+DEFAULT_ADAPTIVE = {"survival_pp": 0.5, "median_pct": None, "confidence": 0.95}
+
+def _batches(plan, entropy, sizes, workers):
+    tasks = [(plan, entropy, i, n, "exact") for i, n in enumerate(sizes)]
+    if workers > 1:
+        from .parallel import map_chunks
+        # ワーカー数ぶんずつ投入し、停止したら残りのラウンドは投入しない
+        for start in range(0, len(tasks), workers):
+            yield from map_chunks(tasks[start:start + workers], workers)
+    else:
+        for t in tasks: yield simulate_chunk(*t)
+
+class AdaptiveRun:
+    # バッチ順にパスを受け取り、精度目標に達したかを判定する (run_adaptive とバックグラウンド実行で共用)
+    def __init__(self, plan, scenario):
+        self.settings = {**DEFAULT_ADAPTIVE, **scenario["adaptive"]}
+        self.stream = scenario["aggregation"] == "stream"
+        self.final_sketch = PathSketch(1)  # 停止判定用 (最終年だけ)
+        self.agg = PathSketch(len(plan["flows"]) + 1) if self.stream else []
+        self.stats, self.num_paths, self.converged = None, 0, False
+
+    def add(self, paths, batch_stats):
+        # バッチを加え、精度目標に達したら True を返す
+        self.num_paths += paths.shape[0]
+        self.stats = batch_stats if self.stats is None else self.stats.merge(batch_stats)
+        self.final_sketch.update(paths[:, -1:])
+        if self.stream: self.agg.update(paths)
+        else: self.agg.append(paths)
+
+        # 分散低減サンプリングの効果は実効パス数として停止判定に反映される
+        survival, _ = self.stats.estimates()
+        summary = precision_summary(self.final_sketch, self.num_paths, survival * 100, self.settings["confidence"], self.stats.variance_reduction()["survival"])
+        self.converged = precision_met(summary, self.final_sketch.percentile(50)[-1], self.settings["survival_pp"], self.settings["median_pct"])
+        return self.converged
+
+    def result(self):
+        # (パス行列 または PathSketch, SamplingStats, 目標達成したか)
+        return (self.agg if self.stream else np.concatenate(self.agg, axis=0)), self.stats, self.converged
+
+def batch_sizes(scenario):
+    return split_chunks(scenario["num_simulations"], scenario["chunk_size"] or ADAPTIVE_BATCH_SIZE)
+
+def run_adaptive(plan, scenario, workers=1):
+    # (パス行列 または PathSketch, SamplingStats, 目標達成したか) を返す
+    run = AdaptiveRun(plan, scenario)
+    entropy = np.random.SeedSequence(scenario["seed"]).entropy
+    for paths, batch_stats in _batches(plan, entropy, batch_sizes(scenario), workers):
+        if run.add(paths, batch_stats): break
+    return run.result()
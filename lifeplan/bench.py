@@ -0,0 +1,159 @@
+import argparse
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+
+from .core import existing_housing_info, future_housing_info, simulate
+from .timeline import EDU_COSTS
+from .timing import STAGE_LABELS, StageTimer
+
+# ==========================================
+# ▼ ベンチマーク (段階ごとの処理速度・ピークメモリ) ▼
+# ==========================================
+# 代表的なシナリオ (期間の長短・子供 0〜5人と全進学コース・多数のイベント・住宅の種類) を
+# 同じシードで繰り返し計算し、段階ごとの時間の中央値・処理速度とピークメモリを出す。
+# デプロイ前に前回の結果 (--json で保存したもの) と比べ、遅くなった段階があれば終了コード 1 を返す。
+#   python -m lifeplan.bench -o bench.json
+#   python -m lifeplan.bench --baseline bench.json --tolerance 25
+
+COURSES = list(EDU_COSTS)
+
+def _phases(end_age):
+    return [{"end": min(45, end_age - 1), "amount": 100}, {"end": min(60, end_age - 1), "amount": 200}, {"end": end_age, "amount": -100}]
+
+def bench_scenarios():
+    # {名前: シナリオ}
+    base = {"current_age": 35, "current_assets": 500, "phases_list": _phases(100), "events_list": [], "children_list": []}
+    scenarios = {
+        "short_horizon": {**base, "phases_list": _phases(55)},
+        "long_horizon": {**base, "current_age": 25, "phases_list": _phases(105)},
+    }
+    for k in range(6):
+        # 子供 k 人。コースは全種類を順に割り当てる (5人で全コースの大半を通る)
+        children = [{"age": (3 * i) % 18, "course": COURSES[(k + i) % len(COURSES)]} for i in range(k)]
+        scenarios[f"children_{k}"] = {**base, "children_list": children}
+    scenarios["all_courses"] = {**base, "children_list": [{"age": i % 10, "course": c} for i, c in enumerate(COURSES)]}
+    scenarios["many_events"] = {**base, "events_list": [{"age": 36 + i % 60, "amount": (-1) ** i * 100 * (1 + i % 7), "name": f"e{i}"} for i in range(60)]}
+    scenarios["housing_none"] = base
+    scenarios["housing_future"] = {**base, "housing_info": future_housing_info(40, 4000, 500, 1.5, 35, 120)}
+    scenarios["housing_already"] = {**base, "housing_info": existing_housing_info(35, 3000, 1.5, 25)}
+    scenarios["monthly"] = {**base, "children_list": [{"age": 5, "course": "private_uni"}], "time_step": "month"}
+    return scenarios
+
+def _render(res):
+    from .chart import chart_data, render_asset_chart
+    return render_asset_chart(chart_data(res))
+
+def _table(res):
+    # 画面の分布表と同じ文字列の表を作り、st.dataframe と同じく Arrow に変換する
+    import pandas as pd
+    from .core import DECILE_RANGES
+    data = {"ランク": [r[2] for r in DECILE_RANGES]}
+    for j, age in enumerate(res["table_ages"]):
+        data[f"{age}歳"] = [f"{int(v):,} 万円" for v in res["decile_table"][:, j]]
+    df = pd.DataFrame(data)
+    try:
+        import pyarrow as pa
+        pa.Table.from_pandas(df)
+    except ImportError:
+        pass
+    return df
+
+def run_once(scenario, chart=True, table=True):
+    timer = StageTimer()
+    with timer.activate():
+        res = simulate(scenario)
+    if chart:
+        with timer.measure("chart"): _render(res)
+    if table:
+        with timer.measure("table"): _table(res)
+    return res, timer
+
+def peak_memory_mb(scenario, chart=True, table=True):
+    # tracemalloc は Python と NumPy の確保を数える (計測自体で遅くなるので、時間の計測とは別に1回だけ流す)
+    tracemalloc.start()
+    try:
+        run_once(scenario, chart, table)
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+def bench(num_simulations=10000, repeat=3, only=None, chart=True, table=True, seed=0):
+    # {シナリオ名: {"years", "num_paths", "stages": {段階: {"ms", "throughput"}}, "total_ms", "peak_mb"}}
+    report = {}
+    for name, scenario in bench_scenarios().items():
+        if only and name not in only: continue
+        scenario = {**scenario, "num_simulations": num_simulations, "seed": seed}
+        if chart or table: run_once(scenario, chart, table)   # 初回だけの import・フォント登録を除く
+        runs = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            res, timer = run_once(scenario, chart, table)
+            runs.append((timer, time.perf_counter() - start))
+        years, num_paths = int(res["years"]), int(res["num_paths"])
+        stages = {}
+        for stage_name in runs[0][0].seconds:
+            ms = statistics.median(t.seconds[stage_name] for t, _ in runs) * 1000
+            # モンテカルロは (パス × 年) / 秒、それ以外は 1秒あたりの回数
+            per_sec = (num_paths * years if stage_name == "monte_carlo" else 1) / max(ms / 1000, 1e-9)
+            stages[stage_name] = {"ms": round(ms, 3), "throughput": round(per_sec, 1)}
+        report[name] = {"years": years, "num_paths": num_paths, "stages": stages,
+                        "total_ms": round(statistics.median(total for _, total in runs) * 1000, 3),
+                        "peak_mb": round(peak_memory_mb(scenario, chart, table), 2)}
+    return report
+
+def compare(report, baseline, tolerance_pct=25.0, min_ms=1.0):
+    # 前回より tolerance_pct % 以上遅くなった段階 (と増えたピークメモリ) を [(シナリオ, 段階, 前回, 今回), ...] で返す
+    # min_ms 未満の段階は揺れが大きいので比べない
+    regressions = []
+    for name, cur in report.items():
+        old = baseline.get(name)
+        if old is None: continue
+        for stage_name, st in cur["stages"].items():
+            prev = old["stages"].get(stage_name)
+            if prev is None or max(prev["ms"], st["ms"]) < min_ms: continue
+            if st["ms"] > prev["ms"] * (1 + tolerance_pct / 100):
+                regressions.append((name, stage_name, prev["ms"], st["ms"]))
+        if cur["peak_mb"] > old["peak_mb"] * (1 + tolerance_pct / 100):
+            regressions.append((name, "peak_mb", old["peak_mb"], cur["peak_mb"]))
+    return regressions
+
+def format_report(report):
+    lines = [f"{'シナリオ':<16}{'年数':>5}  {'段階':<20}{'ms':>10}{'処理速度':>16}"]
+    for name, r in report.items():
+        for i, (stage_name, st) in enumerate(r["stages"].items()):
+            unit = "パス年/秒" if stage_name == "monte_carlo" else "回/秒"
+            head = f"{name:<16}{r['years']:>5}" if i == 0 else " " * 21
+            lines.append(f"{head}  {STAGE_LABELS.get(stage_name, stage_name):<20}{st['ms']:>10.2f}{st['throughput']:>14,.0f} {unit}")
+        lines.append(f"{'':21}  {'合計 / ピークメモリ':<20}{r['total_ms']:>10.2f}{r['peak_mb']:>12.1f} MB")
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m lifeplan.bench", description="代表的なシナリオで段階ごとの処理速度とピークメモリを計測する")
+    parser.add_argument("-n", "--num-simulations", type=int, default=10000, help="試行回数 (既定: 10000)")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="繰り返し回数 (中央値を報告。既定: 3)")
+    parser.add_argument("--only", nargs="+", choices=list(bench_scenarios()), default=None, help="計測するシナリオ")
+    parser.add_argument("--no-chart", action="store_true", help="グラフ描画 (matplotlib) を計測しない")
+    parser.add_argument("--no-table", action="store_true", help="表の作成 (pandas) を計測しない")
+    parser.add_argument("-o", "--json", default=None, help="結果を JSON で保存する")
+    parser.add_argument("--baseline", default=None, help="比較する前回の結果 (JSON)")
+    parser.add_argument("--tolerance", type=float, default=25.0, help="遅くなったとみなす割合 (%%、既定: 25)")
+    args = parser.parse_args(argv)
+
+    report = bench(args.num_simulations, args.repeat, args.only, not args.no_chart, not args.no_table)
+    print(format_report(report))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for name, stage_name, prev, cur in regressions:
+            print(f"遅くなりました: {name} / {STAGE_LABELS.get(stage_name, stage_name)}: {prev:,.2f} -> {cur:,.2f}", file=sys.stderr)
+        if regressions: return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
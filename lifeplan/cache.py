@@ -0,0 +1,88 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .core import normalize_scenario
+
+def _canonical(obj):
+    # JSON 化の前に型の揺れ (numpy 型 / tuple / 5 と 5.0) を吸収する
+    if isinstance(obj, dict):
+        return {str(k): _canonical(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_canonical(v) for v in obj]
+    if isinstance(obj, np.ndarray):
+        return [_canonical(v) for v in obj.tolist()]
+    if isinstance(obj, np.generic):
+        obj = obj.item()
+    if isinstance(obj, float) and obj.is_integer():
+        return int(obj)
+    return obj
+
+def scenario_key(scenario):
+    # 全入力 (デフォルト補完後) の正規化 JSON の SHA-256
+    payload = json.dumps(_canonical(normalize_scenario(scenario)), sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ResultCache:
+    # 件数上限つきの LRU キャッシュ。複数セッションから共有されるのでロックで保護する
+    # 格納した結果は共有されるため、呼び出し側で書き換えないこと
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+def cached_sweep(scenario, axes, cache):
+    # axes: (利回りの値, リスクの値, インフレ率の値)。キーはシナリオと軸の値をまとめてハッシュする
+    from .sweep import sweep_grid
+    run = lambda: sweep_grid(scenario, *axes)
+    if normalize_scenario(scenario)["seed"] is None:
+        return run()
+    return cache.get_or_compute(scenario_key({**scenario, "sweep_axes": [list(a) for a in axes]}), run)
+
+def cached_compare(scenario, variants, cache):
+    # variants はシナリオと一緒にキーに含める (名前も表示に使うので含める)
+    from .compare import compare_scenarios
+    run = lambda: compare_scenarios(scenario, variants)
+    if normalize_scenario(scenario)["seed"] is None:
+        return run()
+    return cache.get_or_compute(scenario_key({**scenario, "compare_variants": variants}), run)
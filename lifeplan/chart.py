@@ -0,0 +1,174 @@
+import hashlib
+import io
+
+import numpy as np
+
+# ==========================================
+# ▼ 資産推移グラフ ▼
+# ==========================================
+# 背景の塗り分けは「年ごとに1枚」ではなく「連続した期間ごとに1枚」にまとめて描く。
+# 描画結果 (PNG) はプロットするデータのハッシュで引けるので、呼び出し側でキャッシュできる。
+
+CHART_DPI = 100
+
+def mask_runs(mask):
+    # True が連続する区間を [(開始index, 終了index(含まない)), ...] で返す
+    padded = np.concatenate([[False], np.asarray(mask, dtype=bool), [False]])
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    return list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+
+def chart_data(res):
+    # グラフに描くものだけを取り出す (この内容が同じなら同じ画像になる)
+    timeline, years = res["timeline"], res["years"]
+    # 20/50/80 以外に指定されたパーセンタイルは細い線で重ねる
+    extra_qs = [q for q in res["percentiles"] if q not in (20, 50, 80)]
+    return {
+        "ages": res["ages"],
+        "principal": res["principal"],
+        "deterministic": res["deterministic"],
+        "median": res["median"],
+        "top_20": res["top_20"],
+        "bottom_20": res["bottom_20"],
+        "edu_mask": timeline["edu_total"] > 0,
+        "deficit_mask": timeline["net_flow"][:years] < 0,
+        "loan_mask": timeline["loan_mask"][:years],
+        "extra_qs": np.array(extra_qs, dtype=float),
+        "extra_lines": np.array([res["percentiles"][q] for q in extra_qs]).reshape(len(extra_qs), len(res["ages"])),
+    }
+
+def chart_key(data):
+    h = hashlib.sha256()
+    for name in sorted(data):
+        arr = np.ascontiguousarray(data[name])
+        h.update(name.encode())
+        h.update(str(arr.dtype).encode())
+        h.update(arr.tobytes())
+    return h.hexdigest()
+
+def render_asset_chart(data):
+    # PNG のバイト列を返す。pyplot の共有状態を使わないのでセッション間で干渉しない
+    import japanize_matplotlib  # noqa: F401 (日本語フォントの登録)
+    import matplotlib.ticker as ticker
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(10, 6))
+    # bbox_inches="tight" は余白計算のために2回描画するので、余白は固定で指定する
+    fig.subplots_adjust(left=0.09, right=0.98, bottom=0.09, top=0.93)
+    ax = fig.subplots()
+    age_axis = data["ages"]
+    start_age = int(age_axis[0])
+
+    for s, e in mask_runs(data["edu_mask"]):
+        ax.axvspan(start_age + s, start_age + e, color='cyan', alpha=0.1)
+    for s, e in mask_runs(data["deficit_mask"]):
+        ax.axvspan(start_age + s, start_age + e, color='orange', alpha=0.1)
+    for s, e in mask_runs(data["loan_mask"]):
+        ax.axvspan(start_age + s, start_age + e, ymin=0, ymax=0.05, color='purple', alpha=0.5)
+
+    ax.plot(age_axis, data["principal"], color='gray', linewidth=2, linestyle='-', label='積立元本')
+    ax.plot(age_axis, data["deterministic"], color='orange', linewidth=3, linestyle=':', label='単純計算')
+    ax.plot(age_axis, data["median"], color='blue', linewidth=2, label='中央値')
+    ax.plot(age_axis, data["top_20"], color='green', linestyle='--', linewidth=1, label='好調 (上位20%)')
+    ax.plot(age_axis, data["bottom_20"], color='red', linestyle='--', linewidth=1, label='不調 (下位20%)')
+    for q, line in zip(data["extra_qs"], data["extra_lines"]):
+        ax.plot(age_axis, line, color='slategray', linestyle='-.', linewidth=0.8, alpha=0.8, label=f'{q:g}パーセンタイル')
+
+    ax.set_title("資産推移", fontsize=14)
+    ax.set_xlabel("年齢")
+    ax.set_ylabel("資産額 (万円)")
+    ax.legend()
+    ax.grid(True, linestyle='--', alpha=0.7)
+    ax.yaxis.set_major_formatter(ticker.FuncFormatter(lambda x, p: f'{int(x):,}'))
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", dpi=CHART_DPI)
+    return buf.getvalue()
+
+# ==========================================
+# ▼ 感応度ヒートマップ ▼
+# ==========================================
+def heatmap_data(sweep, inflation_index=0):
+    # sweep_grid の結果から、インフレ率を1つ選んだ (利回り × リスク) の面を取り出す
+    return {
+        "mean_returns_pct": sweep["mean_returns_pct"],
+        "risk_stds_pct": sweep["risk_stds_pct"],
+        "survival": sweep["survival"][:, :, inflation_index],
+        "median_final": sweep["median_final"][:, :, inflation_index],
+        "marker": np.asarray(sweep.get("marker", [np.nan, np.nan]), dtype=float),
+    }
+
+def render_sweep_heatmap(data):
+    # 左: 生存率 / 右: 最終資産の中央値。縦軸が利回り、横軸がリスク。marker は現在の設定 (利回り, リスク)
+    import japanize_matplotlib  # noqa: F401 (日本語フォントの登録)
+    from matplotlib.figure import Figure
+
+    means, stds = data["mean_returns_pct"], data["risk_stds_pct"]
+    # セルの中心が各値に来るように、隣との中点を境界にする
+    edges = lambda v: np.concatenate([[v[0] - (v[1] - v[0]) / 2 if len(v) > 1 else v[0] - 0.5],
+                                      (v[:-1] + v[1:]) / 2,
+                                      [v[-1] + (v[-1] - v[-2]) / 2 if len(v) > 1 else v[-1] + 0.5]])
+    fig = Figure(figsize=(12, 5))
+    fig.subplots_adjust(left=0.06, right=0.97, bottom=0.12, top=0.9, wspace=0.25)
+    axes = fig.subplots(1, 2)
+    panels = [("survival", "生存率 (%)", "RdYlGn", dict(vmin=0, vmax=100)),
+              ("median_final", "最終資産の中央値 (万円)", "viridis", {})]
+    for ax, (key, title, cmap, lim) in zip(axes, panels):
+        mesh = ax.pcolormesh(edges(stds), edges(means), data[key], cmap=cmap, shading="flat", **lim)
+        fig.colorbar(mesh, ax=ax, format=lambda x, p: f"{x:,.0f}")
+        if key == "survival" and data[key].min() < 100:
+            ax.contour(stds, means, data[key], levels=[80], colors="black", linewidths=1)
+        if not np.isnan(data["marker"]).any():
+            ax.plot(data["marker"][1], data["marker"][0], marker="*", color="white", markeredgecolor="black", markersize=14)
+        ax.set_title(title)
+        ax.set_xlabel("リスク (標準偏差%)")
+        ax.set_ylabel("想定利回り (年率%)")
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", dpi=CHART_DPI)
+    return buf.getvalue()
+
+# ==========================================
+# ▼ プランの比較グラフ ▼
+# ==========================================
+# 比較するプランの線の色 (先頭が基準のプラン)
+COMPARE_COLORS = ["blue", "darkorange", "green", "purple", "brown", "teal"]
+
+def compare_chart_data(comparison):
+    # プランごとに年数が違ってもよいように、いちばん長い年齢軸にそろえて足りない分は NaN にする (NaN は描かれない)
+    variants = comparison["variants"]
+    ages = max((v["ages"] for v in variants), key=len)
+    pad = lambda line: np.concatenate([line, np.full(len(ages) - len(line), np.nan)])
+    return {
+        "ages": ages,
+        "names": np.array([v["name"] for v in variants]),
+        "median": np.array([pad(v["median"]) for v in variants]),
+        "top_20": np.array([pad(v["top_20"]) for v in variants]),
+        "bottom_20": np.array([pad(v["bottom_20"]) for v in variants]),
+    }
+
+def render_compare_chart(data):
+    # 中央値を太線、上位・下位20% を同じ色の細い破線で重ねる
+    import japanize_matplotlib  # noqa: F401 (日本語フォントの登録)
+    import matplotlib.ticker as ticker
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(10, 6))
+    fig.subplots_adjust(left=0.09, right=0.98, bottom=0.09, top=0.93)
+    ax = fig.subplots()
+    ages = data["ages"]
+    for k, name in enumerate(data["names"]):
+        color = COMPARE_COLORS[k % len(COMPARE_COLORS)]
+        ax.plot(ages, data["median"][k], color=color, linewidth=2, label=f"{name} (中央値)")
+        ax.plot(ages, data["top_20"][k], color=color, linestyle='--', linewidth=0.8, alpha=0.7)
+        ax.plot(ages, data["bottom_20"][k], color=color, linestyle='--', linewidth=0.8, alpha=0.7)
+
+    ax.set_title("プランの比較 (実線: 中央値 / 破線: 上位・下位20%)", fontsize=14)
+    ax.set_xlabel("年齢")
+    ax.set_ylabel("資産額 (万円)")
+    ax.legend()
+    ax.grid(True, linestyle='--', alpha=0.7)
+    ax.yaxis.set_major_formatter(ticker.FuncFormatter(lambda x, p: f'{int(x):,}'))
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", dpi=CHART_DPI)
+    return buf.getvalue()
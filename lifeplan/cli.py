@@ -0,0 +1,83 @@
+import argparse
+import json
+import sys
+
+from .core import simulate, summary_metrics
+from .history import HISTORICAL_SERIES
+from .models import GENERATED_MODELS
+from .parallel import CHUNK_SIZE
+from .sampling import SAMPLING_METHODS
+
+# シナリオファイル (JSONL, 1行1シナリオ) を一括でシミュレーションし、要約指標を JSONL で書き出す
+#   python -m lifeplan scenarios.jsonl -o summary.jsonl
+
+def run_batch(lines, out, num_simulations=None, seed=None, chunk_size=None, workers=1, aggregation=None, adaptive=None,
+              sampling=None, control_variate=None, history_series=None, block_years=None, return_model=None,
+              time_step=None):
+    count = 0
+    for line_no, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line: continue
+        row = {"line": line_no}
+        try:
+            scenario = json.loads(line)
+            row["id"] = scenario.pop("id", None)
+            if num_simulations is not None: scenario["num_simulations"] = num_simulations
+            if seed is not None: scenario["seed"] = seed
+            if chunk_size is not None: scenario["chunk_size"] = chunk_size
+            if aggregation is not None: scenario["aggregation"] = aggregation
+            if adaptive is not None: scenario["adaptive"] = adaptive
+            if sampling is not None: scenario["sampling"] = sampling
+            if control_variate is not None: scenario["control_variate"] = control_variate
+            if return_model is not None: scenario["return_model"] = return_model
+            if history_series is not None: scenario.update(return_model="bootstrap", history_series=history_series)
+            if block_years is not None: scenario["block_years"] = block_years
+            if time_step is not None: scenario["time_step"] = time_step
+            row.update(summary_metrics(simulate(scenario, workers=workers)))
+        except Exception as e:
+            row["error"] = str(e)
+        out.write(json.dumps(row, ensure_ascii=False) + "\n")
+        count += 1
+    return count
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="lifeplan", description="資産ライフプランのシナリオを一括でシミュレーションします")
+    parser.add_argument("scenarios", help="シナリオの JSONL ファイル ('-' で標準入力)")
+    parser.add_argument("-o", "--output", default="-", help="要約指標の出力先 JSONL ('-' で標準出力)")
+    parser.add_argument("-n", "--num-simulations", type=int, default=None, help="全シナリオの試行回数を上書き")
+    parser.add_argument("--seed", type=int, default=None, help="全シナリオの乱数シードを上書き")
+    parser.add_argument("--chunk-size", type=int, default=None, help="チャンク分割して独立した乱数列で計算する (並列実行に必要)")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="プロセスプールのワーカー数")
+    parser.add_argument("--stream", action="store_true", help="パスを保持せずヒストグラムで集計する (メモリ一定・近似)")
+    parser.add_argument("--target-survival-pp", type=float, default=None,
+                        help="生存率の信頼区間の半幅 (%%pt) がこの値以下になったら打ち切る (-n は上限になる)")
+    parser.add_argument("--target-median-pct", type=float, default=None,
+                        help="最終中央値の信頼区間の半幅 (%%) がこの値以下になったら打ち切る")
+    parser.add_argument("--sampling", choices=list(SAMPLING_METHODS.keys()), default=None, help="乱数の引き方 (分散低減)")
+    parser.add_argument("--control-variate", action="store_true", default=None, help="制御変量で生存率・平均を補正する")
+    parser.add_argument("--return-model", choices=GENERATED_MODELS, default=None,
+                        help="利回りのモデル (平均・標準偏差は想定利回り・リスクに合わせる)")
+    parser.add_argument("--bootstrap", choices=list(HISTORICAL_SERIES.keys()), default=None, dest="history_series",
+                        help="正規分布の代わりに、この系列の過去リターンをブロック単位で復元抽出する")
+    parser.add_argument("--block-years", type=int, default=None, help="ブートストラップのブロックの長さ (年)")
+    parser.add_argument("--monthly", action="store_true", help="収支を12か月に分け、月ごとに複利で計算する")
+    args = parser.parse_args(argv)
+    adaptive = None
+    if args.target_survival_pp is not None or args.target_median_pct is not None:
+        adaptive = {"survival_pp": args.target_survival_pp, "median_pct": args.target_median_pct}
+    if args.workers > 1 and args.chunk_size is None:
+        args.chunk_size = CHUNK_SIZE
+
+    src = sys.stdin if args.scenarios == "-" else open(args.scenarios, encoding="utf-8")
+    dst = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        run_batch(src, dst, args.num_simulations, args.seed, args.chunk_size, args.workers,
+                  "stream" if args.stream else None, adaptive, args.sampling, args.control_variate,
+                  args.history_series, args.block_years, args.return_model, "month" if args.monthly else None)
+    finally:
+        if src is not sys.stdin: src.close()
+        if dst is not sys.stdout: dst.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+import numpy as np
+
+from .core import advance_paths, common_returns, normalize_scenario, prepare_run, summarize_run
+from .sampling import SamplingStats
+from .stats import z_value
+
+# ==========================================
+# ▼ プランの比較 (同じ乱数で複数のプランを計算) ▼
+# ==========================================
+# variants: [{"name": 表示名, "changes": {シナリオの上書き}}, ...]。先頭が比較の基準。
+# リターン行列は simulate と同じ引き方で年数ごとに1度だけ引き、同じ年数のプランはそれを共有する
+# (各プランの結果は、そのプランを simulate で計算した結果と一致する)。
+# 同じ乱数の上で比べるので、プラン間の差はモンテカルロのばらつきではなく収支の違いから出る。
+# 生存率の差の信頼区間も、パスごとの対 (同じ乱数の上での生存・破綻の違い) から求めるので狭くなる
+# (年数の違うプランどうしは乱数列が変わるので、対の相関の分だけ狭くなる効果は小さい)。
+
+# 乱数の引き方や計算の前提を決める項目。プランごとに変えると同じ乱数で比べられないので変更できない
+SHARED_KEYS = (
+    "current_age", "inflation_rate_pct", "mean_return_pct", "risk_std_pct",
+    "return_model", "model_params", "history_series", "block_years", "portfolio",
+    "num_simulations", "seed", "chunk_size", "sampling", "time_step",
+)
+
+def compare_scenarios(scenario, variants, confidence=0.95):
+    base = normalize_scenario(scenario)
+    if not variants: raise ValueError("比較するプランを1つ以上指定してください")
+    runs = []
+    for v in variants:
+        fixed = [k for k in SHARED_KEYS if k in v["changes"] and v["changes"][k] != base[k]]
+        if fixed: raise ValueError(f"{v['name']}: 比較では変えられない項目です: {', '.join(fixed)}")
+        try:
+            s, timeline, plan = prepare_run({**base, **v["changes"]})
+        except ValueError as e:
+            raise ValueError(f"{v['name']}: {e}") from e
+        runs.append((v["name"], s, timeline, plan))
+
+    # 比較はパスどうしの対を使うので、集計方法・試行回数の打ち切りによらず全パスを保持する
+    returns_by_years = {}
+    z = z_value(confidence)
+
+    results, base = [], None
+    for name, s, timeline, plan in runs:
+        years = len(plan["flows"])
+        if years not in returns_by_years:
+            returns_by_years[years] = common_returns(plan, {**s, "aggregation": "exact"})
+        returns = returns_by_years[years]
+        num_paths = returns.shape[0]
+        paths = advance_paths(plan, s["current_assets"], returns)
+        alive = paths[:, -1] > 0
+        # 生存率・パーセンタイルは simulate と同じ集計 (制御変量ありなら補正後の生存率) にそろえる
+        stats = SamplingStats(plan["sampling"], plan["control_variate"]).update(plan, returns, paths)
+        res = summarize_run({**s, "aggregation": "exact", "adaptive": None}, timeline, plan, paths, stats)
+        survival = float(100 - res["ruin_prob"])
+        if base is None: base = (alive, survival)
+        # 基準との差 (%pt) と、その対の差の標本標準偏差からの信頼区間
+        # (制御変量の補正は差の分散を小さくする方向なので、補正前の対の差から求めた幅は保守的)
+        diff = alive.astype(float) - base[0]
+        diff_pp = survival - base[1]
+        half = float(z * diff.std(ddof=1) / np.sqrt(num_paths) * 100) if num_paths > 1 else 0.0
+        results.append({
+            "name": name,
+            "scenario": s,
+            "end_age": res["end_age"],
+            "ages": res["ages"],
+            "percentiles": res["percentiles"],
+            "median": res["median"],
+            "top_20": res["top_20"],
+            "bottom_20": res["bottom_20"],
+            "deterministic": res["deterministic"],
+            "principal": res["principal"],
+            "survival": survival,
+            "mean_final": res["mean_final"],
+            "survival_diff": diff_pp,
+            "survival_diff_ci": (diff_pp - half, diff_pp + half),
+        })
+    return {"variants": results, "num_paths": num_paths, "confidence": confidence}
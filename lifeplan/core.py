@@ -0,0 +1,416 @@
+import copy
+
+import numpy as np
+
+from .models import prepare_model
+from .portfolio import prepare_portfolio, run_portfolio
+from .sampling import SamplingStats, draw_returns
+from .sketch import PathSketch
+from .timeline import EDU_COSTS, STAGE_NAMES, compile_timeline, get_end_age, get_school_stage  # noqa: F401 (再エクスポート)
+from .stats import precision_summary
+from .timing import stage
+
+# 資産額分布表のランク (下限%, 上限%, 表示名)
+DECILE_RANGES = [
+    (90, 100, "上位 10%"), (80, 90, "11% - 20%"), (70, 80, "21% - 30%"), (60, 70, "31% - 40%"),
+    (50, 60, "41% - 50% (中央)"), (40, 50, "51% - 60%"), (30, 40, "61% - 70%"), (20, 30, "71% - 80%"),
+    (10, 20, "81% - 90%"), (0, 10, "91% - 100% (下位)")
+]
+
+# ==========================================
+# ▼ シナリオ（入力一式） ▼
+# ==========================================
+NO_HOUSING = {"type": "none", "annual_pmt": 0, "start_age": 0, "end_age": 0, "current_rent_saved": 0}
+
+DEFAULT_SCENARIO = {
+    "current_age": 35,
+    "current_assets": 500,
+    "inflation_rate_pct": 2.0,
+    "mean_return_pct": 5.0,
+    "risk_std_pct": 15.0,
+    "housing_info": NO_HOUSING,
+    "use_pension": True,
+    "pension_start_age": 65,
+    "pension_annual": 240,
+    "phases_list": [],
+    "children_list": [],
+    "events_list": [],
+    # 利回りのモデル (models.RETURN_MODELS): "normal" (想定利回り・リスクの正規分布) /
+    #   "student_t" / "regime" / "garch" (平均・標準偏差は想定利回り・リスクに合わせる。細かい設定は model_params) /
+    #   "bootstrap" (history_series の過去リターンを block_years 年ずつ復元抽出。想定利回り・リスクは使わない)
+    "return_model": "normal",
+    "model_params": None,
+    "history_series": "sp500",
+    "block_years": 5,
+    # None: 1つの資産 (想定利回り・リスク) で運用 / dict: 複数資産の配分・相関・リバランス (portfolio.py を参照)
+    "portfolio": None,
+    "num_simulations": 10000,
+    "seed": None,
+    # None: 1本の乱数列 (np.random.seed 互換)。整数: その件数ずつのチャンクに分け、
+    # チャンクごとに SeedSequence から独立した乱数列を割り当てる (並列実行はこちら)
+    "chunk_size": None,
+    # "exact": 全パスを保持して集計 / "stream": チャンクごとに年別ヒストグラムへ
+    # 畳み込み、メモリを試行回数によらず一定に保つ (誤差は sketch.py を参照)
+    "aggregation": "exact",
+    # None: 試行回数は固定 / dict: 精度目標に達した時点で打ち切る (num_simulations は上限)
+    #   {"survival_pp": 生存率の信頼区間の半幅 (%pt), "median_pct": 最終中央値の半幅 (%), "confidence": 0.95}
+    "adaptive": None,
+    # 乱数の引き方: "plain" / "antithetic" (対称変量) / "sobol" (スクランブル Sobol 列)
+    "sampling": "plain",
+    # True: 解析的に期待値が分かる量を制御変量にして生存率を補正する
+    "control_variate": False,
+    # 推移を出すパーセンタイル (20/50/80 はグラフ・指標で使うので常に計算する)
+    "percentiles": [20, 50, 80],
+    # 資産額分布表の年齢刻み (1 なら毎年)
+    "table_step": 10,
+    # "year": 年初に1年分の収支を入れて1年分成長 / "month": 収支を12か月に分け、月ごとに入れて複利で成長
+    "time_step": "year",
+}
+
+def normalize_scenario(scenario):
+    # 未指定の項目をデフォルトで埋めたコピーを返す
+    s = copy.deepcopy(DEFAULT_SCENARIO)
+    s.update(copy.deepcopy(scenario))
+    s["housing_info"] = {**NO_HOUSING, **s["housing_info"]}
+    if not s["use_pension"]:
+        s["pension_annual"] = 0
+    return s
+
+def loan_annual_payment(principal, rate_pct, years):
+    # 元利均等・月払いの年間返済額
+    r = rate_pct / 100 / 12
+    n = years * 12
+    monthly_pmt = principal * (r * (1+r)**n) / ((1+r)**n - 1) if r > 0 else principal / n
+    return monthly_pmt * 12
+
+def future_housing_info(purchase_age, price, down_payment, rate_pct, years, current_rent):
+    # これから購入: 購入後は家賃が浮き、代わりにローン返済が始まる
+    loan_principal = price - down_payment
+    if loan_principal <= 0: return dict(NO_HOUSING)
+    return {"type": "future", "annual_pmt": loan_annual_payment(loan_principal, rate_pct, years),
+            "start_age": purchase_age, "end_age": purchase_age + years - 1, "current_rent_saved": current_rent}
+
+def existing_housing_info(current_age, loan_principal, rate_pct, years_remain):
+    # 購入済み: 完済後は返済額分だけ収支が改善する
+    if loan_principal <= 0: return dict(NO_HOUSING)
+    return {"type": "already", "annual_pmt": loan_annual_payment(loan_principal, rate_pct, years_remain),
+            "start_age": current_age, "end_age": current_age + years_remain - 1, "current_rent_saved": 0}
+
+def make_plan(s, timeline, years):
+    # 乱数を引いてパスを進めるのに必要な入力一式 (プロセスプールのワーカーにもこのまま渡す)
+    flows, spots = timeline["net_flow"][:years], timeline["spot"][:years]
+    plan = {"initial_assets": s["current_assets"], "flows": flows, "spots": spots,
+            "mean": (s["mean_return_pct"] - s["inflation_rate_pct"]) / 100, "std": s["risk_std_pct"] / 100,
+            "sampling": s["sampling"], "control_variate": s["control_variate"], "time_step": s["time_step"]}
+    if s["time_step"] == "month":
+        # 年額の収支は12か月に均等に割り、イベントは指定の月に入れる
+        plan["monthly_cash"] = flows[:, None] / 12 + timeline["spot_month"][:years]
+    elif s["time_step"] != "year":
+        raise ValueError(f"未対応の計算単位です: {s['time_step']}")
+    prepare_model(plan, s)
+    if s["portfolio"]: prepare_portfolio(plan, s)
+    return plan
+
+def get_table_ages(current_age, end_age, step=10):
+    t_ages = list(range(current_age, end_age + 1, step))
+    if t_ages[-1] != end_age: t_ages.append(end_age)
+    return t_ages
+
+# ==========================================
+# ▼ シミュレーション本体 ▼
+# ==========================================
+def run_monte_carlo(initial_assets, flows, spots, returns):
+    # returns: (試行回数, 年数) の実質リターン行列。全パスを年ごとにまとめて進める
+    # 資産が0になったパスは以降も0のまま（破綻）、マイナスは0に切り上げ
+    num_paths, years = returns.shape
+    growth = (1 + returns).T
+    results = np.empty((years + 1, num_paths))
+    results[0] = initial_assets
+    for y in range(years):
+        prev = results[y]
+        new_val = (prev + flows[y] + spots[y]) * growth[y]
+        np.maximum(new_val, 0, out=new_val)
+        new_val[prev <= 0] = 0
+        results[y + 1] = new_val
+    return results.T
+
+def run_monte_carlo_monthly(initial_assets, monthly_cash, returns):
+    # 月次版。returns は年率の実質リターン (試行回数, 年数) で、1年を12か月の等しい成長 g = (1+r)^(1/12) に分ける。
+    # 月初に入出金 -> 月末まで成長 を12か月分、月を配列の次元としてまとめて計算する (ループは年だけ):
+    #   k か月目末の資産 = 年初の資産 × g^k + Σ_{m<k} c_m × g^(k-m)
+    # どこかの月末で 0 以下になったパスは破綻 (以降 0)。年末時点の値だけを返す (試行回数, 年数+1)
+    num_paths, years = returns.shape
+    results = np.empty((years + 1, num_paths))
+    results[0] = initial_assets
+    months = np.arange(12)
+    for y in range(years):
+        prev, cash = results[y], monthly_cash[y]
+        growth = np.maximum(1 + returns[:, y], 0)   # = g^12
+        g = growth ** (1 / 12)
+        if (cash >= 0).all() or (cash <= 0).all():
+            # 入出金の符号がそろっている年は月末の資産が単調に動くので、年末の値だけで破綻を判定できる。
+            # 年末の値 = 年初 × g^12 + (毎月の額 × Σ_{j=1..12} g^j) + (その額と違う月の差額 × g^(12-m))
+            base = np.median(cash)
+            near_one = np.abs(g - 1) < 1e-9
+            series = np.where(near_one, 12.0, g * (growth - 1) / np.where(near_one, 1.0, g - 1))
+            year_end = prev * growth + base * series
+            for m in months[cash != base]:
+                year_end += (cash[m] - base) * growth ** ((12 - m) / 12)
+            alive = year_end > 0
+        else:
+            # 符号が混ざる年だけ、12か月分の月末の値を (12, 試行回数) で出して途中の破綻も見る
+            powers = np.cumprod(np.broadcast_to(g, (12, num_paths)), axis=0)   # g^1 〜 g^12
+            lag = months[:, None] - months[None, :]   # [k, j] -> 月 k 末に (j+1) か月成長する入金は c[k-j]
+            weights = np.where(lag >= 0, cash[np.clip(lag, 0, 11)], 0.0)
+            month_end = prev * powers + weights @ powers
+            year_end = month_end[-1]
+            alive = month_end.min(axis=0) > 0
+        results[y + 1] = np.where(alive & (prev > 0) & (growth > 0), year_end, 0)
+    return results.T
+
+def advance_paths(plan, initial_assets, returns, start=0):
+    # plan の計算単位 (年次 / 月次) で start 年目から最終年まで進めた資産推移 (試行回数, 残り年数+1)
+    # ポートフォリオでは initial_assets (合計) を目標配分で分けた状態から始める
+    if plan.get("portfolio"):
+        return run_portfolio(initial_assets, plan["flows"][start:], plan["spots"][start:], returns[:, start:], plan["portfolio"])
+    if plan.get("time_step") == "month":
+        return run_monte_carlo_monthly(initial_assets, plan["monthly_cash"][start:], returns[:, start:])
+    return run_monte_carlo(initial_assets, plan["flows"][start:], plan["spots"][start:], returns[:, start:])
+
+def run_deterministic(initial_assets, flows, spots, rate):
+    # 単純計算 (rate=期待リターン) と 積立元本 (運用なし) の推移
+    deterministic_assets = [initial_assets]
+    principal_assets = [initial_assets]
+    for flow, spot in zip(flows, spots):
+        prev_d = deterministic_assets[-1]
+        if prev_d <= 0: new_d = 0
+        else:
+            new_d = (prev_d + flow + spot) * (1 + rate)
+            if new_d < 0: new_d = 0
+        deterministic_assets.append(new_d)
+
+        prev_p = principal_assets[-1]
+        new_p = prev_p + flow + spot
+        if new_p < 0: new_p = 0
+        principal_assets.append(new_p)
+    return np.array(deterministic_assets, dtype=float), np.array(principal_assets, dtype=float)
+
+def summarize_paths(simulation_results, qs, idx_list, in_place=False):
+    # 年ごとの列を1回だけソートし、その結果からパーセンタイル推移・十分位ごとの平均・破綻確率をまとめて出す
+    # in_place=True なら simulation_results 自体を列ごとに並べ替える (パスの対応は崩れるがコピーが不要)
+    by_year = simulation_results.T
+    if in_place: by_year.sort(axis=1)
+    else: by_year = np.sort(by_year, axis=1)
+    n = by_year.shape[1]
+
+    # パーセンタイル: np.percentile(..., axis=0) と同じ線形補間を全年・全 q まとめて
+    pos = np.asarray(qs, dtype=float) / 100 * (n - 1)
+    lo, hi = np.floor(pos).astype(np.int64), np.ceil(pos).astype(np.int64)
+    lines = by_year[:, lo] + (pos - lo) * (by_year[:, hi] - by_year[:, lo])
+
+    # 十分位ごとの平均: 区切り位置ごとの区間和を1パスで取り、累積和の差で各ランクの合計を出す
+    # (表の刻みを細かくしても、ソート済みの行から値を拾う量が増えるだけ)
+    starts = np.array([int(n * s / 100) for s, e, _ in DECILE_RANGES])
+    ends = np.array([int(n * e / 100) for s, e, _ in DECILE_RANGES])
+    edges = np.union1d(starts, ends)
+    edges = edges[edges < n]
+    seg = np.add.reduceat(by_year[idx_list], edges, axis=1) if len(edges) else np.zeros((len(idx_list), 0))
+    cum = np.concatenate([np.zeros((len(idx_list), 1)), np.cumsum(seg, axis=1)], axis=1)
+    at = lambda b: cum[:, np.searchsorted(edges, b)]
+    width = ends - starts
+    table = np.where(width > 0, (at(ends) - at(starts)) / np.maximum(width, 1), 0).T
+
+    # 破綻確率: ソート済みなので 0 の件数は二分探索で数えられる
+    ruin_prob = np.searchsorted(by_year[-1], 0, side="right") / n * 100
+    return {q: lines[:, i] for i, q in enumerate(qs)}, table, ruin_prob
+
+def chunk_rng(entropy, index):
+    # SeedSequence(entropy).spawn(n)[index] と同じ独立ストリーム。n やワーカー数に依存しない
+    return np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(index,)))
+
+def split_chunks(num_simulations, chunk_size):
+    return [min(chunk_size, num_simulations - start) for start in range(0, num_simulations, chunk_size)]
+
+# ストリーミング集計時、1度に展開するパス数 (np.random.seed 互換の乱数列の場合。exact と同じパスになるのは plain のみ)
+STREAM_BLOCK_SIZE = 10000
+
+def _reduce(paths, aggregation):
+    return PathSketch.from_paths(paths) if aggregation == "stream" else paths
+
+def _merge(parts, aggregation):
+    # parts は (集計, SamplingStats) の列。イテレータでもよい (stream では1つずつ畳み込むので溜め込まない)
+    aggs, stats = [], None
+    for agg, part_stats in parts:
+        stats = part_stats if stats is None else stats.merge(part_stats)
+        if aggregation == "stream":
+            aggs = [agg] if not aggs else [aggs[0].merge(agg)]
+        else:
+            aggs.append(agg)
+    if aggregation == "stream":
+        return aggs[0], stats
+    return np.concatenate(aggs, axis=0), stats
+
+def simulate_block(plan, rng, num_paths, aggregation="exact"):
+    returns = draw_returns(rng, plan, num_paths)
+    paths = advance_paths(plan, plan["initial_assets"], returns)
+    stats = SamplingStats(plan["sampling"], plan["control_variate"]).update(plan, returns, paths)
+    return _reduce(paths, aggregation), stats
+
+def simulate_chunk(plan, entropy, index, num_paths, aggregation="exact"):
+    # 1チャンク分のパスを計算する (プロセスプールのワーカーからも呼ばれる)
+    # stream 集計ではパス行列ではなくヒストグラムだけを返す
+    return simulate_block(plan, chunk_rng(entropy, index), num_paths, aggregation)
+
+def simulate_paths(plan, num_simulations, seed=None, chunk_size=None, workers=1, aggregation="exact"):
+    # (集計, SamplingStats) を返す。集計は exact ならパス行列 (試行回数, 年数+1)、stream なら PathSketch
+    if chunk_size is None:
+        if workers > 1:
+            raise ValueError("並列実行には chunk_size の指定が必要です")
+        # seed 指定時は np.random.seed(seed) と同じ乱数列になる
+        # 通常の乱数の引き方 (plain) なら、行単位で分けて引いても乱数列は同じなので、stream でも exact と同じパスから作られる
+        # (対称変量・Sobol 列・制御変量はブロックごとに引き方・補正が決まるので、exact とはパスが変わる)
+        rng = np.random.RandomState(seed)
+        block = num_simulations if aggregation == "exact" else STREAM_BLOCK_SIZE
+        return _merge((simulate_block(plan, rng, n, aggregation) for n in split_chunks(num_simulations, block)), aggregation)
+
+    # チャンク i には常に同じ乱数列が割り当たるので、結果はワーカー数によらず一致する
+    entropy = np.random.SeedSequence(seed).entropy
+    tasks = [(plan, entropy, i, n, aggregation) for i, n in enumerate(split_chunks(num_simulations, chunk_size))]
+    if workers > 1:
+        from .parallel import map_chunks
+        return _merge(map_chunks(tasks, workers), aggregation)
+    return _merge((simulate_chunk(*t) for t in tasks), aggregation)
+
+def common_returns(plan, s):
+    # simulate_paths と同じ乱数の引き方でリターン行列 (試行回数, 年数[, 資産数]) をまとめて作る
+    # (ゴールシーク・プランの比較で、同じ乱数の上で収支だけを変えて計算し直すのに使う)
+    num_simulations = s["num_simulations"]
+    if s["chunk_size"] is None:
+        rng = np.random.RandomState(s["seed"])
+        block = num_simulations if s["aggregation"] == "exact" else STREAM_BLOCK_SIZE
+        return np.concatenate([draw_returns(rng, plan, n) for n in split_chunks(num_simulations, block)])
+    entropy = np.random.SeedSequence(s["seed"]).entropy
+    return np.concatenate([draw_returns(chunk_rng(entropy, i), plan, n) for i, n in enumerate(split_chunks(num_simulations, s["chunk_size"]))])
+
+def deterministic_lines(plan, s):
+    # (単純計算, 積立元本) の推移。単純計算は期待リターン (ブートストラップでは系列の平均 - インフレ率) で進める
+    years = len(plan["flows"])
+    deterministic_assets, principal_assets = run_deterministic(s["current_assets"], plan["flows"], plan["spots"], plan["mean"])
+    if s["time_step"] == "month":
+        deterministic_assets = advance_paths(plan, s["current_assets"], np.full((1, years), plan["mean"]))[0]
+    return deterministic_assets, principal_assets
+
+def prepare_run(scenario):
+    # (正規化したシナリオ, 収支の年表, plan) を返す。パスの計算は simulate / バックグラウンド実行 (jobs.py) が行う
+    s = normalize_scenario(scenario)
+    current_age = s["current_age"]
+    end_age = get_end_age(s)
+    years = end_age - current_age
+    if years <= 0:
+        raise ValueError(f"終了年齢({end_age}歳)は、現在の年齢({current_age}歳)より未来に設定してください。")
+    with stage("timeline"):
+        timeline = compile_timeline(s)
+    with stage("plan"):
+        plan = make_plan(s, timeline, years)
+    return s, timeline, plan
+
+def simulate(scenario, keep_paths=False, workers=1):
+    # workers は実行方法だけを決め、結果には影響しない (chunk_size 指定時)
+    s, timeline, plan = prepare_run(scenario)
+    with stage("monte_carlo"):
+        if s["adaptive"]:
+            from .adaptive import run_adaptive
+            simulation_results, sampling_stats, converged = run_adaptive(plan, s, workers)
+        else:
+            simulation_results, sampling_stats = simulate_paths(plan, s["num_simulations"], s["seed"], s["chunk_size"], workers, s["aggregation"])
+            converged = None
+    return summarize_run(s, timeline, plan, simulation_results, sampling_stats, converged, keep_paths)
+
+def summarize_run(s, timeline, plan, simulation_results, sampling_stats, converged=None, keep_paths=False):
+    # 集計 (パス行列 または PathSketch) と SamplingStats から結果の dict を作る
+    # keep_paths=False ならパス行列はその場で並べ替える (呼び出し側で以後使わないこと)
+    current_age = s["current_age"]
+    years = len(plan["flows"])
+    end_age = current_age + years
+    deterministic_assets, principal_assets = deterministic_lines(plan, s)
+
+    table_ages = get_table_ages(current_age, end_age, s["table_step"])
+    table_idx = [ta - current_age for ta in table_ages]
+    qs = sorted(set(s["percentiles"]) | {20, 50, 80})
+    with stage("summarize"):
+        if s["aggregation"] == "stream":
+            sketch = simulation_results
+            num_paths = sketch.count
+            percentiles = sketch.percentiles(qs)
+            ruin_prob = sketch.ruin_prob()
+            decile_table = sketch.decile_means(table_idx, DECILE_RANGES)
+        else:
+            num_paths = simulation_results.shape[0]
+            # パス行列を返さない場合はその場でソートしてコピーを省く
+            percentiles, decile_table, ruin_prob = summarize_paths(simulation_results, qs, table_idx, in_place=not keep_paths)
+    with stage("precision"):
+        survival_est, mean_final = sampling_stats.estimates()
+        if s["control_variate"]:
+            ruin_prob = 100 - survival_est * 100
+        variance_reduction = sampling_stats.variance_reduction()
+        confidence = (s["adaptive"] or {}).get("confidence", 0.95)
+        precision = precision_summary(simulation_results, num_paths, 100 - ruin_prob, confidence, variance_reduction["survival"])
+
+    result = {
+        "scenario": s,
+        "current_age": current_age,
+        "end_age": end_age,
+        "years": years,
+        "ages": np.arange(current_age, end_age + 1),
+        "timeline": timeline,
+        "deterministic": deterministic_assets,
+        "principal": principal_assets,
+        "median": percentiles[50],
+        "top_20": percentiles[80],
+        "bottom_20": percentiles[20],
+        # {q: 各年の q パーセンタイル}
+        "percentiles": percentiles,
+        "ruin_prob": ruin_prob,
+        "table_ages": table_ages,
+        "decile_table": decile_table,
+        # 精度: 実際に使ったパス数と、生存率・最終中央値の信頼区間
+        "num_paths": num_paths,
+        "confidence": confidence,
+        "survival_ci": precision["survival_ci"],
+        "median_ci": precision["median_ci"],
+        "converged": converged,
+        # 最終資産の平均 (制御変量ありなら補正後)
+        "mean_final": mean_final,
+        # 通常サンプリングに比べて推定量の分散が何分の1になったか (1 = 効果なし)
+        #   {"survival": 生存率, "mean_final": 最終資産の平均}
+        "sampling": s["sampling"],
+        "control_variate": s["control_variate"],
+        "variance_reduction": variance_reduction,
+    }
+    # stream 集計ではパス行列を保持しないので keep_paths は無視される
+    if keep_paths and s["aggregation"] == "exact":
+        result["paths"] = simulation_results
+    return result
+
+def summary_metrics(result):
+    # バッチ出力用の要約指標
+    return {
+        "end_age": int(result["end_age"]),
+        "survival_rate": float(100 - result["ruin_prob"]),
+        "ruin_prob": float(result["ruin_prob"]),
+        "deterministic_final": float(result["deterministic"][-1]),
+        "principal_final": float(result["principal"][-1]),
+        "median_final": float(result["median"][-1]),
+        "top_20_final": float(result["top_20"][-1]),
+        "bottom_20_final": float(result["bottom_20"][-1]),
+        "total_education": float(result["timeline"]["edu_total"].sum()),
+        "num_paths": int(result["num_paths"]),
+        "survival_ci_low": float(result["survival_ci"][0]),
+        "survival_ci_high": float(result["survival_ci"][1]),
+        "median_ci_low": float(result["median_ci"][0]),
+        "median_ci_high": float(result["median_ci"][1]),
+        "mean_final": float(result["mean_final"]),
+        "vr_survival": result["variance_reduction"]["survival"],
+        "vr_mean_final": result["variance_reduction"]["mean_final"],
+        **{f"p{q:g}_final": float(result["percentiles"][q][-1]) for q in result["scenario"]["percentiles"]},
+    }
@@ -0,0 +1,104 @@
+import copy
+
+import numpy as np
+
+from .core import advance_paths, common_returns, make_plan, normalize_scenario, prepare_run
+from .timeline import compile_timeline, get_end_age
+
+# ==========================================
+# ▼ 目標生存率からの逆算 (ゴールシーク) ▼
+# ==========================================
+# 乱数 (リターン行列) と基準シナリオの資産推移を1度だけ計算しておき、
+# 変数を動かしたときは収支が変わる最初の年から先だけを計算し直す。
+# 同じ乱数の上では、収支を増やせば各パスの資産は減らない (破綻も増えない) ので、
+# 生存率は変数に対して単調になり、整数の二分探索で境目が求まる (金額・年齢とも整数で扱われる)。
+GOAL_VARIABLES = {
+    "phase_amount": "期間の年間収支 (万円)",
+    "phase_end": "期間の終了年齢 (＝次の期間の開始)",
+    "event_amount": "イベントの金額 (万円)",
+    "pension_start_age": "年金の受給開始年齢",
+}
+
+def get_variable(scenario, variable, index=None):
+    if variable == "phase_amount": return int(scenario["phases_list"][index]["amount"])
+    if variable == "phase_end": return int(scenario["phases_list"][index]["end"])
+    if variable == "event_amount": return int(scenario["events_list"][index]["amount"])
+    if variable == "pension_start_age": return int(scenario["pension_start_age"])
+    raise ValueError(f"未対応の変数です: {variable}")
+
+def set_variable(scenario, variable, index, value):
+    # 変数だけを書き換えたコピーを返す
+    s = copy.deepcopy(scenario)
+    if variable == "phase_amount": s["phases_list"][index]["amount"] = int(value)
+    elif variable == "phase_end": s["phases_list"][index]["end"] = int(value)
+    elif variable == "event_amount": s["events_list"][index]["amount"] = int(value)
+    elif variable == "pension_start_age": s["pension_start_age"] = int(value)
+    else: raise ValueError(f"未対応の変数です: {variable}")
+    return s
+
+def default_bounds(scenario, variable, index=None):
+    # 探索範囲の既定値 (両端を含む)
+    s = normalize_scenario(scenario)
+    value = get_variable(s, variable, index)
+    if variable == "phase_amount": return (value - 2000, value + 2000)
+    if variable == "event_amount": return (value - 5000, value + 5000)
+    if variable == "phase_end":
+        # 終了年齢を動かすと全体の期間が変わるので、最後の期間は対象外
+        phases = s["phases_list"]
+        if index >= len(phases) - 1:
+            raise ValueError("最後の期間の終了年齢は変数にできません（シミュレーション期間そのものが変わるため）")
+        start = phases[index - 1]["end"] + 1 if index > 0 else s["current_age"]
+        return (int(start), int(phases[index + 1]["end"]) - 1)
+    return (max(60, s["current_age"]), min(75, get_end_age(s)))
+
+def goal_seek(scenario, variable, target_survival=80.0, index=None, bounds=None):
+    # 生存率 (%) が target_survival 以上になる変数の境目を探す。
+    # 返り値の status:
+    #   "ok"    : 範囲内に境目あり。value は目標を満たす側の端の値
+    #   "always": 範囲のどこでも目標を満たす。value は生存率が低い側の端
+    #   "never" : 範囲のどこでも目標に届かない。value は生存率が高い側の端
+    s, _, plan = prepare_run(scenario)
+    years = len(plan["flows"])
+    lo, hi = bounds if bounds is not None else default_bounds(s, variable, index)
+    if lo > hi: lo, hi = hi, lo
+
+    returns = common_returns(plan, s)
+    base = advance_paths(plan, s["current_assets"], returns).T   # (年数+1, 試行回数)
+
+    history = {}
+    def survival_at(value):
+        if value not in history:
+            trial = set_variable(s, variable, index, value)
+            p = make_plan(trial, compile_timeline(trial), years)
+            changed = np.flatnonzero((p["flows"] != plan["flows"]) | (p["spots"] != plan["spots"]))
+            # ポートフォリオは毎年リバランスするときだけ、年初の合計から配分を復元して途中から計算できる
+            if len(changed) and plan.get("portfolio") and plan["portfolio"]["rebalance"] != "annual": changed = [0]
+            final = base[-1] if len(changed) == 0 else advance_paths(p, base[changed[0]], returns, changed[0])[:, -1]
+            history[value] = float((final > 0).mean() * 100)
+        return history[value]
+
+    ok_lo, ok_hi = survival_at(lo) >= target_survival, survival_at(hi) >= target_survival
+    if ok_lo == ok_hi:
+        lower_side = lo if survival_at(lo) <= survival_at(hi) else hi
+        status, value = ("always", lower_side) if ok_lo else ("never", hi if lower_side == lo else lo)
+    else:
+        # 目標を満たす側を ok_lo と同じ向きに保ったまま区間を狭める
+        a, b = lo, hi
+        while b - a > 1:
+            mid = (a + b) // 2
+            if (survival_at(mid) >= target_survival) == ok_lo: a = mid
+            else: b = mid
+        status, value = "ok", a if ok_lo else b
+
+    return {
+        "variable": variable,
+        "index": index,
+        "target_survival": target_survival,
+        "status": status,
+        "value": value,
+        "survival": survival_at(value),
+        "bounds": (lo, hi),
+        "evaluations": sorted(history.items()),
+        "scenario": set_variable(s, variable, index, value),
+        "num_paths": s["num_simulations"],
+    }
@@ -0,0 +1,92 @@
+import argparse
+import csv
+import functools
+import os
+import sys
+
+import numpy as np
+
+from .rng import rng_method
+
+# ==========================================
+# ▼ ヒストリカル・ブートストラップ ▼
+# ==========================================
+# 過去の年次リターン系列から、連続した数年 (ブロック) 単位で復元抽出してリターン行列を作る。
+# 正規分布では出ない大きな下落や、不調な年が続く並び (順序リスク) がそのまま残る。
+#
+# 系列は 1次元 float64 の .npy (年率リターン・小数、円ベース・配当込みの名目値) として
+# RETURNS_DIR に置き、メモリマップで読む。プロセス内では1度だけ開き、全セッションで共有する
+# (ワーカープロセス間も OS のページキャッシュで共有される)。
+# CSV からの作成: python -m lifeplan.history 年次リターン.csv --name sp500
+HISTORICAL_SERIES = {
+    "topix": "TOPIX (配当込み)",
+    "acwi": "オルカン (MSCI ACWI・円換算)",
+    "sp500": "S&P500 (配当込み・円換算)",
+}
+RETURNS_DIR = os.environ.get("LIFEPLAN_RETURNS_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "returns"))
+DEFAULT_BLOCK_YEARS = 5
+
+def series_path(name):
+    return os.path.join(RETURNS_DIR, f"{name}.npy")
+
+def available_series():
+    # データファイルが置かれている系列だけを返す
+    return [name for name in HISTORICAL_SERIES if os.path.exists(series_path(name))]
+
+@functools.lru_cache(maxsize=None)
+def load_series(name):
+    if name not in HISTORICAL_SERIES:
+        raise ValueError(f"未対応のリターン系列です: {name}")
+    path = series_path(name)
+    if not os.path.exists(path):
+        raise ValueError(f"リターン系列のデータがありません: {path}（python -m lifeplan.history で作成してください）")
+    series = np.load(path, mmap_mode="r")
+    if series.ndim != 1 or series.dtype != np.float64 or len(series) < 2:
+        raise ValueError(f"リターン系列の形式が不正です: {path}")
+    return series
+
+def bootstrap_returns(rng, series, num_paths, years, block_years=DEFAULT_BLOCK_YEARS):
+    # (試行回数, 年数) の名目リターン。ブロックの開始年を全パス分まとめて引き、
+    # 系列の末尾は先頭につなげて (循環) どの年も同じ確率で選ばれるようにする
+    block_years = max(1, min(int(block_years), len(series)))
+    num_blocks = -(-years // block_years)
+    starts = rng_method(rng, "integers")(0, len(series), size=(num_paths, num_blocks))
+    idx = (starts[:, :, None] + np.arange(block_years)) % len(series)
+    return np.asarray(series)[idx.reshape(num_paths, -1)[:, :years]]
+
+# ==========================================
+# ▼ CSV -> .npy 変換 ▼
+# ==========================================
+def read_csv_returns(path):
+    # 列 year, return_pct (年率%) の CSV を年の順に並べて小数のリターンにする
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        if reader.fieldnames is None or not {"year", "return_pct"} <= set(reader.fieldnames):
+            raise ValueError(f"列 year, return_pct の見出しがありません: {path}")
+        rows = sorted((int(r["year"]), float(r["return_pct"])) for r in reader)
+    if len(rows) < 2:
+        raise ValueError(f"年次リターンの行が2年分以上必要です: {path}")
+    years = [y for y, _ in rows]
+    if len(set(years)) != len(years) or years != list(range(years[0], years[0] + len(years))):
+        raise ValueError("year が重複しているか、途中の年が抜けています")
+    return np.array([r for _, r in rows], dtype=np.float64) / 100, years[0]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m lifeplan.history", description="年次リターンの CSV をメモリマップ用の .npy に変換する")
+    parser.add_argument("csv", help="列 year, return_pct (年率%%) の CSV")
+    parser.add_argument("--name", required=True, choices=list(HISTORICAL_SERIES), help="系列名")
+    parser.add_argument("-o", "--out-dir", default=RETURNS_DIR, help=f"出力先 (既定: {RETURNS_DIR})")
+    args = parser.parse_args(argv)
+
+    try:
+        series, first_year = read_csv_returns(args.csv)
+    except ValueError as e:
+        parser.error(str(e))
+    os.makedirs(args.out_dir, exist_ok=True)
+    out = os.path.join(args.out_dir, f"{args.name}.npy")
+    np.save(out, series)
+    print(f"{out}: {first_year}〜{first_year + len(series) - 1}年 ({len(series)}年分) 平均 {series.mean():.2%} 標準偏差 {series.std():.2%}", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
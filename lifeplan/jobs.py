@@ -0,0 +1,251 @@
+import copy
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .adaptive import AdaptiveRun, batch_sizes
+from .core import prepare_run, simulate_chunk, simulate_paths, split_chunks, summarize_run
+from .timing import StageTimer
+
+# ==========================================
+# ▼ バックグラウンド実行 (全セッション共通のワーカープール) ▼
+# ==========================================
+# 計算はセッションのスクリプトスレッドではなく、サーバープロセス共通のプロセスプール (parallel.py) で行う。
+#   - ジョブはバッチ (チャンク) 単位でワーカーに投入する。空いたワーカーにはセッションを順番に回って
+#     1バッチずつ入れるので、大きなジョブの後ろに並ばされることはない (待つのは実行中のバッチ分だけ)
+#   - 1セッション1ジョブ。同じセッションから別の入力のジョブが来たら、前のジョブは取り消す
+#   - 実行待ち・実行中のジョブ数には上限があり、超えたら JobQueueFull
+#   - バッチが終わるたびに途中までを集計に畳み込み、snapshot() で暫定の結果を返す
+#   - 完了時のコールバック (プロセスプールの管理スレッド) では畳み込みだけを行い、パーセンタイルなどの
+#     最終的な集計はスケジューラーの集計用スレッドで行う (管理スレッドを止めると全セッションの結果の受け取りが止まる)
+# バッチの分け方と乱数列は simulate と同じなので、最終結果は simulate(scenario) と一致する
+# (chunk_size 未指定のジョブは np.random.seed 互換の1本の乱数列なので、1バッチで計算する)。
+
+MAX_ACTIVE_JOBS = 32
+# 終わったジョブ (結果) をセッションごとに残しておく数の上限
+MAX_FINISHED_JOBS = 256
+# 最終的な集計 (summarize_run) を行うスレッドの数
+SUMMARY_THREADS = 2
+
+class JobQueueFull(RuntimeError):
+    pass
+
+class Job:
+    def __init__(self, session_id, key, scenario):
+        self.session_id = session_id
+        self.key = key
+        # 段階ごとの時間。モンテカルロはワーカーでの計算・待ちを含めた投入から完了までの時間
+        self.timer = StageTimer()
+        with self.timer.activate():
+            self.s, self.timeline, self.plan = prepare_run(scenario)
+        self._started = time.perf_counter()
+        s, plan = self.s, self.plan
+        entropy = np.random.SeedSequence(s["seed"]).entropy
+        if s["adaptive"]:
+            sizes = batch_sizes(s)
+        elif s["chunk_size"] is None:
+            sizes = [s["num_simulations"]]
+        else:
+            sizes = split_chunks(s["num_simulations"], s["chunk_size"])
+        if s["chunk_size"] is None and not s["adaptive"]:
+            self.tasks = [(simulate_paths, (plan, s["num_simulations"], s["seed"], None, 1, s["aggregation"]))]
+        else:
+            # 精度目標で止まるジョブは run_adaptive と同じく、バッチをパス行列で受け取って停止判定する
+            aggregation = "exact" if s["adaptive"] else s["aggregation"]
+            self.tasks = [(simulate_chunk, (plan, entropy, i, n, aggregation)) for i, n in enumerate(sizes)]
+        self.total_paths = sum(sizes)   # 精度目標で止まるジョブでは上限
+        self.done_paths = 0
+        self.status = "running"   # running / done / cancelled / error
+        self.error = None
+        self._next = 0            # 次に投入するタスク
+        self._futures = {}
+        self._parts = {}          # 順番待ちの終わったバッチ (バッチ順に畳み込むため)
+        self._merged = 0
+        self._complete = False    # 全バッチ (または精度目標) まで畳み込み済みで、最終的な集計を待っている
+        self._adaptive = AdaptiveRun(plan, s) if s["adaptive"] else None
+        self._agg, self._stats = [], None
+        self._result = None
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+
+    # --- スケジューラーから呼ばれる ---
+    def has_next(self):
+        return self.status == "running" and self._next < len(self.tasks)
+
+    def take_next(self):
+        index = self._next
+        self._next += 1
+        return index, self.tasks[index]
+
+    def cancel(self):
+        with self._lock:
+            if self.status != "running": return
+            self.status = "cancelled"
+            # 途中までの集計 (パス行列・ヒストグラム) はもう使わないので、すぐ手放す
+            self._parts.clear()
+            self._agg, self._adaptive, self._stats = [], None, None
+        for f in list(self._futures.values()): f.cancel()
+        self._finished.set()
+
+    def add_part(self, index, future):
+        # バッチの完了時に (プロセスプールの管理スレッドで) 呼ばれる。バッチ順にそろった分だけ畳み込み、
+        # 全部 (または精度目標) に達したら True を返す。最終的な集計は finish() で行う
+        with self._lock:
+            if self.status != "running" or self._complete: return False
+            try:
+                self._parts[index] = future.result()
+                if not self._merge_ready(): return False
+                # 精度目標で止まった場合、残りのバッチは投入しない
+                self._next = len(self.tasks)
+                self._complete = True
+                self.timer.add("monte_carlo", time.perf_counter() - self._started)
+            except Exception as e:
+                self.status, self.error = "error", e
+                self._agg, self._adaptive, self._stats = [], None, None
+                self._finished.set()
+            self._parts = {}
+        for f in list(self._futures.values()): f.cancel()
+        return self._complete and self.status == "running"
+
+    def finish(self):
+        # 畳み込み終わった集計から結果を作る (スケジューラーの集計用スレッドで呼ばれる)。
+        # 畳み込みが終わった後は集計を書き換える人がいないので、ロックの外で計算する
+        if self.status != "running": return
+        try:
+            agg, stats, converged = self._collect()
+            with self.timer.activate():
+                result = summarize_run(self.s, self.timeline, self.plan, agg, stats, converged)
+        except Exception as e:
+            result, error = None, e
+        else:
+            error = None
+        with self._lock:
+            self._agg, self._adaptive, self._stats = [], None, None
+            if self.status == "running":   # 集計中に取り消されていなければ
+                self._result = result
+                self.status, self.error = ("done", None) if error is None else ("error", error)
+        self._finished.set()
+
+    def _merge_ready(self):
+        # 順番のそろったバッチを畳み込み、ジョブが終わったら True。ロックを持った状態で呼ぶ
+        while self._merged in self._parts:
+            agg, stats = self._parts.pop(self._merged)
+            self._merged += 1
+            if self._adaptive is not None:
+                self.done_paths += agg.shape[0]
+                if self._adaptive.add(agg, stats): return True
+                continue
+            self.done_paths += agg.count if self.s["aggregation"] == "stream" else agg.shape[0]
+            self._stats = stats if self._stats is None else self._stats.merge(stats)
+            if self.s["aggregation"] == "stream":
+                self._agg = [agg] if not self._agg else [self._agg[0].merge(agg)]
+            else:
+                self._agg.append(agg)
+        return self._merged == len(self.tasks)
+
+    def _collect(self):
+        # (集計, SamplingStats, 精度目標に達したか)。ロックを持った状態か、畳み込みが終わった後に呼ぶ
+        if self._adaptive is not None:
+            return self._adaptive.result()
+        if self.s["aggregation"] == "stream":
+            return self._agg[0], self._stats, None
+        return np.concatenate(self._agg, axis=0), self._stats, None
+
+    # --- 画面側から呼ばれる ---
+    def done(self):
+        return self._finished.is_set()
+
+    def wait(self, timeout=None):
+        return self._finished.wait(timeout)
+
+    def result(self):
+        # 完了していれば結果の dict を返す (エラーならその例外を送出する)
+        if self.error is not None: raise self.error
+        if self.status == "cancelled": raise RuntimeError("計算は取り消されました（入力が変更されました）")
+        return self._result
+
+    def snapshot(self):
+        # 途中までのバッチで作った暫定の結果。まだ1バッチも終わっていなければ None、完了後は最終結果
+        with self._lock:
+            if self._result is not None or self.status != "running": return self._result
+            if self._merged == 0 or self._complete: return None
+            if self._adaptive is not None and not self._adaptive.stream:
+                agg, stats = np.concatenate(self._adaptive.agg, axis=0), copy.deepcopy(self._adaptive.stats)
+            elif self._adaptive is not None:
+                agg, stats = copy.deepcopy(self._adaptive.agg), copy.deepcopy(self._adaptive.stats)
+            else:
+                agg, stats, _ = self._collect()
+                agg, stats = (copy.deepcopy(agg) if self.s["aggregation"] == "stream" else agg), copy.deepcopy(stats)
+        return {**summarize_run(self.s, self.timeline, self.plan, agg, stats), "partial": True}
+
+class JobScheduler:
+    def __init__(self, workers, max_active=MAX_ACTIVE_JOBS):
+        self.workers = workers
+        self.max_active = max_active
+        self._jobs = OrderedDict()   # セッション -> 最新のジョブ
+        self._turns = deque()         # バッチを投入する順番 (セッションの巡回)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._summaries = ThreadPoolExecutor(max_workers=SUMMARY_THREADS, thread_name_prefix="lifeplan-summary")
+
+    def submit(self, session_id, key, scenario):
+        # 同じ入力 (key) のジョブがあればそれを返す。入力が変わっていれば前のジョブを取り消して新しく始める
+        with self._lock:
+            job = self._jobs.get(session_id)
+            if job is not None and job.key == key and job.status in ("running", "done"):
+                return job
+        job = Job(session_id, key, scenario)   # 入力の検証エラーはここで送出される
+        with self._lock:
+            old = self._jobs.pop(session_id, None)
+            active = sum(j.status == "running" for j in self._jobs.values())
+            if active >= self.max_active:
+                if old is not None: self._jobs[session_id] = old
+                raise JobQueueFull("混み合っているため、計算を受け付けられませんでした。しばらくしてから実行してください")
+            self._jobs[session_id] = job
+            if session_id not in self._turns: self._turns.append(session_id)
+            self._trim()
+        if old is not None: old.cancel()
+        self._dispatch()
+        return job
+
+    def cancel(self, session_id):
+        # 取り消したジョブは結果を返さないので、終わったジョブとしても残さない
+        with self._lock:
+            job = self._jobs.get(session_id)
+            if job is not None and job.status == "running": del self._jobs[session_id]
+        if job is not None: job.cancel()
+
+    def _trim(self):
+        # 終わったジョブは古いものから捨てる。ロックを持った状態で呼ぶ
+        finished = [sid for sid, j in self._jobs.items() if j.status != "running"]
+        for sid in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[sid]
+
+    def _dispatch(self):
+        # 空いているワーカーの数だけ、セッションを巡回して1バッチずつ投入する
+        from .parallel import get_pool
+        submitted = []
+        with self._lock:
+            while self._in_flight < self.workers and self._turns:
+                sid = self._turns.popleft()
+                job = self._jobs.get(sid)
+                if job is None or not job.has_next(): continue
+                index, (fn, args) = job.take_next()
+                future = get_pool(self.workers).submit(fn, *args)
+                job._futures[index] = future
+                self._in_flight += 1
+                if job.has_next(): self._turns.append(sid)
+                submitted.append((job, index, future))
+        # 完了済みならコールバックはこの場で呼ばれるので、ロックを離してから登録する
+        for job, index, future in submitted:
+            future.add_done_callback(lambda f, job=job, index=index: self._on_done(job, index, f))
+
+    def _on_done(self, job, index, future):
+        with self._lock:
+            self._in_flight -= 1
+        if not future.cancelled() and job.add_part(index, future):
+            self._summaries.submit(job.finish)
+        self._dispatch()
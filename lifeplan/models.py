@@ -0,0 +1,115 @@
+import numpy as np
+
+from .rng import rng_method
+
+# ==========================================
+# ▼ 利回りモデル (リターン行列の生成器) ▼
+# ==========================================
+# どのモデルも draw(rng, plan, 試行回数, 年数) で (試行回数, 年数) の実質リターン行列を一度に返す。
+# 年をまたぐ再帰 (レジーム・GARCH) は年のループだけで、パス方向はすべて配列演算にする。
+# モデル固有のパラメータは scenario["model_params"] で上書きでき、既定値は "params" にある。
+# 平均・標準偏差は想定利回り・リスク (plan["mean"], plan["std"]) に合わせて校正するので、
+# 単純計算の推移や感応度の見方は正規分布のときと変わらない (合わせられないパラメータは ValueError)。
+#
+# "control_variate": 制御変量の期待値 (各年の平均リターン・成長率の積) がそのまま成り立つか
+#   (年ごとのリターンが平均まわりで無相関なら成り立つ。レジーム・ブートストラップは年の間に相関がある)
+# 分散低減の乱数の引き方 (対称変量・Sobol) は正規分布のモデルだけで使える。
+
+def _student_t(rng, plan, num_paths, years):
+    # 分散を std^2 にそろえた t 分布 (自由度が小さいほど裾が厚い)
+    df = plan["model_params"]["df"]
+    if df <= 2: raise ValueError("t分布の自由度は 2 より大きくしてください")
+    return plan["mean"] + plan["std"] * np.sqrt((df - 2) / df) * rng.standard_t(df, size=(num_paths, years))
+
+def regime_moments(plan):
+    # 2状態 (平常・危機) のマルコフ切り替え。定常分布での平均・分散が mean, std^2 になるよう平常時を決める
+    p = plan["model_params"]
+    to_crisis, to_calm = p["to_crisis"], p["to_calm"]
+    if not (0 < to_crisis <= 1 and 0 < to_calm <= 1): raise ValueError("レジームの切り替え確率は 0〜1 で指定してください")
+    pi = to_crisis / (to_crisis + to_calm)   # 危機の年の割合
+    gap, ratio = p["crisis_gap"], p["crisis_vol_ratio"]
+    calm_mean = plan["mean"] - pi * gap
+    # 平常・危機の平均の差だけで出る分散 pi(1-pi)gap^2 がリスクを超えると、標準偏差を合わせられない
+    spread_var = pi * (1 - pi) * gap ** 2
+    if plan["std"] ** 2 < spread_var * (1 - 1e-9):
+        # 案内する境界は、表示の桁で丸めても条件を満たす側に寄せる
+        min_std = np.ceil(np.sqrt(spread_var) * 1000) / 10
+        max_gap = np.floor(plan["std"] / np.sqrt(pi * (1 - pi)) * 100)
+        raise ValueError(f"リスク {plan['std']:.1%} では、危機の年の利回りの差 {gap:.0%} を再現できません"
+                         f"（リスクを {min_std:.1f}% 以上にするか、差を {-max_gap:.0f}% 〜 0% にしてください）")
+    calm_var = max(plan["std"] ** 2 - spread_var, 0.0) / ((1 - pi) + pi * ratio ** 2)
+    calm_std = np.sqrt(calm_var)
+    return pi, (calm_mean, calm_std), (calm_mean + gap, calm_std * ratio)
+
+def _prepare_regime(plan, s):
+    # 校正できない組み合わせは、乱数を引く前 (入力の検証時) にエラーにする
+    regime_moments(plan)
+
+def _regime(rng, plan, num_paths, years):
+    pi, (calm_mean, calm_std), (crisis_mean, crisis_std) = regime_moments(plan)
+    p = plan["model_params"]
+    z = rng.standard_normal(size=(num_paths, years))
+    u = rng_method(rng, "random")((num_paths, years))
+    crisis = np.empty((num_paths, years), dtype=bool)
+    # 初年は定常分布から、以降は前年の状態からの遷移
+    crisis[:, 0] = u[:, 0] < pi
+    for y in range(1, years):
+        prev = crisis[:, y - 1]
+        crisis[:, y] = np.where(prev, u[:, y] >= p["to_calm"], u[:, y] < p["to_crisis"])
+    return np.where(crisis, crisis_mean + crisis_std * z, calm_mean + calm_std * z)
+
+def _garch(rng, plan, num_paths, years):
+    # GARCH(1,1): σ²_t = ω + α ε²_{t-1} + β σ²_{t-1}。無条件分散が std^2 になるよう ω を決める
+    p = plan["model_params"]
+    alpha, beta = p["alpha"], p["beta"]
+    if alpha < 0 or beta < 0 or alpha + beta >= 1: raise ValueError("GARCH は α, β ≥ 0 かつ α + β < 1 で指定してください")
+    var = plan["std"] ** 2
+    omega = var * (1 - alpha - beta)
+    z = rng.standard_normal(size=(num_paths, years))
+    eps = np.empty((num_paths, years))
+    sigma2 = np.full(num_paths, var)
+    for y in range(years):
+        eps[:, y] = np.sqrt(sigma2) * z[:, y]
+        sigma2 = omega + alpha * eps[:, y] ** 2 + beta * sigma2
+    return plan["mean"] + eps
+
+def _prepare_bootstrap(plan, s):
+    # 系列は名目リターンなので、正規分布モデルと同じくインフレ率を引いて実質にする
+    from .history import load_series
+    series = load_series(s["history_series"])
+    inflation = s["inflation_rate_pct"] / 100
+    plan.update({"history_series": s["history_series"], "block_years": s["block_years"], "inflation": inflation,
+                 "mean": float(np.mean(series)) - inflation, "std": float(np.std(series))})
+
+def _bootstrap(rng, plan, num_paths, years):
+    from .history import bootstrap_returns, load_series
+    return bootstrap_returns(rng, load_series(plan["history_series"]), num_paths, years, plan["block_years"]) - plan["inflation"]
+
+RETURN_MODELS = {
+    # 正規分布は sampling.draw_returns が分散低減つきで引く
+    "normal": {"label": "正規分布", "draw": None, "params": {}, "control_variate": True},
+    "student_t": {"label": "t分布 (裾が厚い)", "draw": _student_t, "params": {"df": 5}, "control_variate": True},
+    "regime": {"label": "レジーム切り替え (平常・危機の2状態)", "draw": _regime, "prepare": _prepare_regime,
+               "params": {"to_crisis": 0.1, "to_calm": 0.5, "crisis_gap": -0.25, "crisis_vol_ratio": 2.0}, "control_variate": False},
+    "garch": {"label": "GARCH(1,1) (変動の大きい年が続く)", "draw": _garch, "params": {"alpha": 0.15, "beta": 0.75}, "control_variate": True},
+    "bootstrap": {"label": "過去リターンのブートストラップ", "draw": _bootstrap, "prepare": _prepare_bootstrap, "params": {},
+                  "control_variate": False},
+}
+
+# 想定利回り・リスクから作るモデル (bootstrap 以外)
+GENERATED_MODELS = [name for name in RETURN_MODELS if name != "bootstrap"]
+
+def prepare_model(plan, s):
+    # make_plan から呼ばれる。plan にモデル名とパラメータを書き込み、組み合わせを検証する
+    name = s["return_model"]
+    if name not in RETURN_MODELS:
+        raise ValueError(f"未対応の利回りモデルです: {name}")
+    model = RETURN_MODELS[name]
+    if name != "normal" and s["sampling"] != "plain":
+        raise ValueError(f"{model['label']} のモデルでは、乱数の引き方は通常のみ使えます")
+    if s["control_variate"] and not model["control_variate"]:
+        raise ValueError(f"{model['label']} のモデルでは、制御変量は使えません（年の間に相関があるため）")
+    plan["return_model"] = name
+    plan["model_params"] = {**model["params"], **(s["model_params"] or {})}
+    if "prepare" in model: model["prepare"](plan, s)
+    return plan
@@ -0,0 +1,42 @@
+import atexit
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from .core import simulate_chunk
+
+# チャンク単位のモンテカルロをプロセスプールで並列実行する
+# プールはプロセス内で1つだけ作り、セッションをまたいで使い回す
+
+# 大規模実行 (10万回〜) で使う標準のチャンクサイズ
+CHUNK_SIZE = 50000
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+def get_pool(workers):
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None: _pool.shutdown(wait=False)
+            # Streamlit のようなマルチスレッドのサーバーから fork しないよう spawn を使う
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = workers
+        return _pool
+
+def shutdown_pool():
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is not None: _pool.shutdown(wait=True)
+        _pool, _pool_workers = None, 0
+
+atexit.register(shutdown_pool)
+
+def _run_task(task):
+    return simulate_chunk(*task)
+
+def map_chunks(tasks, workers):
+    # 結果はタスクの順序どおりに返る (マージ結果がワーカー数に依存しない)
+    # 完了したものから順に受け取れるようイテレータのまま返す
+    return get_pool(workers).map(_run_task, tasks)
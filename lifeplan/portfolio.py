@@ -0,0 +1,137 @@
+import numpy as np
+
+# ==========================================
+# ▼ 複数資産のポートフォリオ ▼
+# ==========================================
+# scenario["portfolio"] を指定すると、資産ごとの利回り・リスク・相関・目標配分で運用する。
+#   {"assets": [{"name": "topix", "mean_return_pct": 5.0, "risk_std_pct": 17.0, "weight_pct": 40}, ...],
+#    "correlation": 資産数×資産数の相関行列 (None なら ASSET_CORRELATIONS から作る),
+#    "rebalance": "annual" / "threshold" / "none", "threshold_pct": 乖離の閾値 (%pt),
+#    "withdrawal_order": 取り崩す資産名の順番 (None なら保有比率どおりに取り崩す)}
+# 相関のあるリターンは、独立な標準正規乱数に相関行列のコレスキー因子を掛けて作る。
+# 状態は (資産数, 試行回数) の保有額で持ち、年のループの中は資産・パスとも配列演算で進める。
+ASSET_PRESETS = {
+    "topix": {"label": "TOPIX", "mean_return_pct": 5.0, "risk_std_pct": 17.0},
+    "acwi": {"label": "オルカン", "mean_return_pct": 6.5, "risk_std_pct": 18.5},
+    "sp500": {"label": "S&P500", "mean_return_pct": 8.0, "risk_std_pct": 21.0},
+    "cash": {"label": "現金・預金", "mean_return_pct": 0.2, "risk_std_pct": 0.0},
+}
+
+# 円ベースの年次リターンの相関の目安 (ここにない組み合わせは 0)
+ASSET_CORRELATIONS = {
+    ("topix", "acwi"): 0.75,
+    ("topix", "sp500"): 0.65,
+    ("acwi", "sp500"): 0.95,
+}
+
+REBALANCE_METHODS = {
+    "annual": "毎年 (年末に目標配分へ戻す)",
+    "threshold": "乖離が閾値を超えたときだけ",
+    "none": "しない (値動きのまま)",
+}
+
+DEFAULT_THRESHOLD_PCT = 5.0
+
+def default_correlation(names):
+    corr = np.eye(len(names))
+    for i, a in enumerate(names):
+        for j, b in enumerate(names):
+            if i != j: corr[i, j] = ASSET_CORRELATIONS.get((a, b), ASSET_CORRELATIONS.get((b, a), 0.0))
+    return corr
+
+def prepare_portfolio(plan, s):
+    # make_plan から呼ばれる。plan["portfolio"] に計算用の配列を用意し、
+    # 単純計算用の plan["mean"], plan["std"] をポートフォリオ全体 (目標配分) の値にする
+    pf = s["portfolio"]
+    if s["return_model"] != "normal" or s["sampling"] != "plain" or s["control_variate"]:
+        raise ValueError("ポートフォリオでは、利回りのモデルは正規分布・乱数の引き方は通常・制御変量なしで計算します")
+    if s["time_step"] != "year":
+        raise ValueError("ポートフォリオは年単位でのみ計算できます")
+    assets = pf["assets"]
+    if not assets: raise ValueError("ポートフォリオの資産を1つ以上指定してください")
+    names = [a["name"] for a in assets]
+    weights = np.array([a["weight_pct"] for a in assets], dtype=float)
+    if (weights < 0).any() or weights.sum() <= 0: raise ValueError("目標配分は 0 以上で、合計が正になるように指定してください")
+    weights /= weights.sum()
+
+    corr = np.asarray(pf.get("correlation") if pf.get("correlation") is not None else default_correlation(names), dtype=float)
+    if corr.shape != (len(names), len(names)) or not np.allclose(corr, corr.T) or not np.allclose(np.diag(corr), 1) or (np.abs(corr) > 1).any():
+        raise ValueError("相関行列は資産数×資産数の対称行列で、対角を 1・各要素を -1〜1 にしてください")
+    # リスク 0 の資産 (現金など) は乱数を引かないので、相関はリスクのある資産どうしだけで効く
+    stds = np.array([a["risk_std_pct"] for a in assets], dtype=float) / 100
+    risky = np.flatnonzero(stds > 0)
+    try:
+        chol = np.linalg.cholesky(corr[np.ix_(risky, risky)])
+    except np.linalg.LinAlgError:
+        raise ValueError("相関行列が正定値ではありません（矛盾する相関の組み合わせです）")
+    # 独立な標準正規乱数 (リスクのある資産の数) -> 各資産のリターンの偏差、の係数 (資産数, リスクのある資産の数)
+    loadings = np.zeros((len(names), len(risky)))
+    loadings[risky] = stds[risky, None] * chol
+
+    rebalance = pf.get("rebalance", "annual")
+    if rebalance not in REBALANCE_METHODS: raise ValueError(f"未対応のリバランス方法です: {rebalance}")
+    order = pf.get("withdrawal_order")
+    if order is not None:
+        unknown = [n for n in order if n not in names]
+        if unknown: raise ValueError(f"取り崩しの順番にない資産が含まれています: {', '.join(unknown)}")
+        # 指定されなかった資産は最後に、並びの順に取り崩す
+        order = [names.index(n) for n in order] + [i for i, n in enumerate(names) if n not in order]
+
+    inflation = s["inflation_rate_pct"] / 100
+    means = np.array([a["mean_return_pct"] for a in assets], dtype=float) / 100 - inflation
+    cov = loadings @ loadings.T
+    plan["portfolio"] = {
+        "names": names, "weights": weights, "means": means, "loadings": loadings,
+        "rebalance": rebalance, "threshold": pf.get("threshold_pct", DEFAULT_THRESHOLD_PCT) / 100,
+        "withdrawal_order": None if order is None else np.array(order),
+    }
+    plan["mean"] = float(weights @ means)
+    plan["std"] = float(np.sqrt(weights @ cov @ weights))
+    return plan
+
+def draw_portfolio_returns(rng, pf, num_paths, years):
+    # (試行回数, 年数, 資産数) の実質リターン。リスクのある資産が1つなら rng.normal(mean, std) と同じ乱数列になる
+    num_assets, num_risky = pf["loadings"].shape
+    if num_risky == 0:
+        return np.broadcast_to(pf["means"], (num_paths, years, num_assets)).copy()
+    z = rng.standard_normal(size=(num_paths * years, num_risky))
+    returns = z @ pf["loadings"].T
+    returns += pf["means"]
+    return returns.reshape(num_paths, years, num_assets)
+
+def run_portfolio(initial_assets, flows, spots, returns, pf):
+    # 年初に入出金 -> 1年分成長 -> 年末にリバランス、の順で進め、合計資産の推移 (試行回数, 年数+1) を返す
+    #   入金: 目標配分どおりに買い付ける
+    #   出金: withdrawal_order の順に売る (None なら保有比率どおり)
+    # 破綻のルールは run_monte_carlo と同じ (合計が 0 になったら以降も 0)
+    num_paths, years, _ = returns.shape
+    weights = pf["weights"][:, None]
+    order = pf["withdrawal_order"]
+    growth = np.maximum(1 + returns, 0).transpose(1, 2, 0)   # (年数, 資産数, 試行回数)
+    holdings = weights * np.broadcast_to(np.asarray(initial_assets, dtype=float), (num_paths,))
+    results = np.empty((years + 1, num_paths))
+    results[0] = holdings.sum(axis=0)
+    for y in range(years):
+        total = results[y]
+        dead = total <= 0
+        cash = flows[y] + spots[y]
+        if cash >= 0:
+            holdings += cash * weights
+        elif order is None:
+            holdings *= np.maximum(1 + cash / np.where(dead, 1.0, total), 0)
+        else:
+            # 順番に並べた保有額の累積から、各資産で売る額をまとめて決める
+            held = holdings[order]
+            before = np.cumsum(held, axis=0) - held
+            holdings[order] = held - np.clip(-cash - before, 0, held)
+        holdings *= growth[y]
+        holdings[:, dead] = 0
+        new_total = holdings.sum(axis=0)
+        if pf["rebalance"] == "annual":
+            np.multiply(weights, new_total, out=holdings)
+        elif pf["rebalance"] == "threshold":
+            drift = np.abs(holdings - weights * new_total).max(axis=0)
+            hit = drift > pf["threshold"] * new_total
+            holdings[:, hit] = weights * new_total[hit]
+        results[y + 1] = new_total
+    return results.T
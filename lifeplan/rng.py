@@ -0,0 +1,16 @@
+import numpy as np
+
+# ==========================================
+# ▼ 乱数生成器の違いの吸収 ▼
+# ==========================================
+# chunk_size 未指定の実行は np.random.seed 互換の RandomState、チャンク実行は Generator で乱数を引く。
+# 利回りモデル・サンプリング・ブートストラップはどちらを渡されても同じ書き方で引けるように、ここを通す。
+
+# Generator のメソッド名 -> 同じ乱数を引く RandomState のメソッド名
+_LEGACY_METHODS = {"random": "random_sample", "integers": "randint"}
+
+def rng_method(rng, name):
+    # RandomState / Generator のどちらでも、Generator の名前で乱数を引くメソッドを返す
+    # (rng_method(rng, "integers")(0, high, size=...) など。引数の並びは両者で同じ)
+    if isinstance(rng, np.random.Generator): return getattr(rng, name)
+    return getattr(rng, _LEGACY_METHODS.get(name, name))
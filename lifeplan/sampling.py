@@ -0,0 +1,211 @@
+import warnings
+
+import numpy as np
+
+from .models import RETURN_MODELS
+from .portfolio import draw_portfolio_returns
+from .rng import rng_method
+
+# ==========================================
+# ▼ 分散低減サンプリング ▼
+# ==========================================
+SAMPLING_METHODS = {
+    "plain": "通常 (独立な正規乱数)",
+    "antithetic": "対称変量 (±のペア)",
+    "sobol": "準モンテカルロ (スクランブル Sobol 列)",
+}
+
+# Sobol 列は2のべき乗の件数で均等性が最も高くなる。このブロックごとに独立にスクランブルし、
+# ブロック間のばらつきから推定量の分散を見積もる
+SOBOL_BLOCK = 512
+
+def _sobol_normals(rng, n, years):
+    from scipy.special import ndtri
+    from scipy.stats import qmc
+
+    z = np.empty((n, years))
+    for start in range(0, n, SOBOL_BLOCK):
+        size = min(SOBOL_BLOCK, n - start)
+        sampler = qmc.Sobol(d=years, scramble=True, rng=int.from_bytes(rng_method(rng, "bytes")(8), "little"))
+        with warnings.catch_warnings():
+            # 端数ブロックが2のべき乗でない警告は承知の上で無視する
+            warnings.simplefilter("ignore", UserWarning)
+            u = sampler.random(size)
+        # 逆正規分布関数で標準正規に写す (u=0 を避ける)
+        z[start:start + size] = ndtri(np.clip(u, 1e-12, 1 - 1e-12))
+    return z
+
+def draw_returns(rng, plan, num_paths):
+    # (試行回数, 年数) の実質リターン行列を plan["sampling"] の方式で引く
+    years = len(plan["flows"])
+    if plan.get("portfolio"):
+        # ポートフォリオは (試行回数, 年数, 資産数) の相関つきリターン
+        return draw_portfolio_returns(rng, plan["portfolio"], num_paths, years)
+    model = plan.get("return_model", "normal")
+    if model != "normal":
+        # 正規分布以外は利回りモデルの生成器に任せる (分散低減なし)
+        return RETURN_MODELS[model]["draw"](rng, plan, num_paths, years)
+    method = plan.get("sampling", "plain")
+    if method == "plain":
+        return rng.normal(plan["mean"], plan["std"], size=(num_paths, years))
+    if method == "antithetic":
+        # 前半 z と後半 -z がペア (i と i + half)。奇数件のときは最後の1本だけペアなし
+        half = num_paths // 2
+        z = rng.standard_normal(size=(half, years))
+        parts = [z, -z]
+        if num_paths % 2: parts.append(rng.standard_normal(size=(1, years)))
+        z = np.concatenate(parts, axis=0)
+    elif method == "sobol":
+        z = _sobol_normals(rng, num_paths, years)
+    else:
+        raise ValueError(f"未対応のサンプリング方式です: {method}")
+    return plan["mean"] + plan["std"] * z
+
+# ==========================================
+# ▼ 推定量の分散 (分散低減効果の計測) ▼
+# ==========================================
+# 2つの推定量 (0: 生存率 = 最終年の資産 > 0 の割合, 1: 最終資産の平均) について、
+# チャンクごとに足し上げられる統計量を持つ。
+# 分散低減率 = (通常サンプリングでの推定量の分散) / (この方式での推定量の分散)
+# 実測の目安 (10万回、生存率 40〜80% のシナリオ。SamplingStats の見積もりと再実行でのばらつきは一致する):
+#   制御変量 (通常の乱数): 生存率 約2〜3倍 / 最終資産の平均 数十〜数百倍
+#   対称変量             : 生存率 約1.3〜4倍 (シナリオで大きく変わる) / 最終資産の平均 約1.1〜1.4倍
+#   Sobol 列             : 生存率 約2.5〜3.5倍 / 最終資産の平均 約4〜6倍 (制御変量を足すと平均は数十〜千倍)
+# 生存率が 100% 近く (破綻がほとんどない) では、生存率の効果はどの方式も 1〜1.2倍程度になる。
+TARGETS = ("survival", "mean_final")
+
+# 対称変量・Sobol のグループ数がこれ未満だと分散の見積もりが不安定なので報告しない
+MIN_GROUPS = 8
+
+def control_values(plan, returns):
+    # 制御変量 (期待値が解析的に分かる量) の期待値からの差を (試行回数, 年数 + 2) で返す
+    #   各年のリターン r_t -> 期待値は平均リターン (順序リスクの線形成分を拾う)
+    #   下限0の切り上げをしない資産推移の最終値 -> 期待値は単純計算の推移 (下限なし)
+    #   累積成長率 Π(1+r) -> 期待値は (1+平均)^年数 (対数正規近似と同じ期待値)
+    growth = 1 + returns
+    suffix = np.cumprod(growth[:, ::-1], axis=1)[:, ::-1]   # suffix[:, t] = Π_{u>=t} (1+r_u)
+    cash = plan["flows"] + plan["spots"]
+    unclamped = plan["initial_assets"] * suffix[:, 0] + suffix @ cash
+
+    g = 1 + plan["mean"]
+    years = returns.shape[1]
+    expected_growth = g ** (years - np.arange(years))
+    expected_unclamped = plan["initial_assets"] * g ** years + expected_growth @ cash
+    return np.column_stack([returns - plan["mean"], unclamped - expected_unclamped, suffix[:, 0] - g ** years])
+
+class SamplingStats:
+    def __init__(self, method, control_variate=False):
+        self.method = method
+        self.control_variate = control_variate
+        self.n = 0
+        self.m1 = _Moments()   # 1本ごと
+        # 対称変量: ペア平均 / Sobol: ブロック平均 (グループ単位で見た推定量のばらつき)
+        self.mg = _Moments()
+        self.group_size = 0
+
+    def update(self, plan, returns, paths):
+        y = np.column_stack([paths[:, -1] > 0, paths[:, -1]]).astype(float)
+        d = control_values(plan, returns) if self.control_variate else None
+        n = len(y)
+        self.n += n
+        self.m1.add(y, d)
+        if self.method == "antithetic" and n >= 2:
+            half = n // 2
+            pair = lambda a: None if a is None else (a[:half] + a[half:2 * half]) / 2
+            self.mg.add(pair(y), pair(d))
+            self.group_size = 2
+        elif self.method == "sobol":
+            full = n // SOBOL_BLOCK * SOBOL_BLOCK
+            if full:
+                block = lambda a: None if a is None else a[:full].reshape(-1, SOBOL_BLOCK, a.shape[1]).mean(axis=1)
+                self.mg.add(block(y), block(d))
+                self.group_size = SOBOL_BLOCK
+        return self
+
+    def merge(self, other):
+        self.n += other.n
+        self.m1.merge(other.m1)
+        self.mg.merge(other.mg)
+        self.group_size = self.group_size or other.group_size
+        return self
+
+    def _beta(self):
+        # 既知平均まわりの回帰係数 β = E[DD']^-1 Cov(D, Y)。桁をそろえてから解く
+        m = self.m1
+        cov_dd = m.sum_dd / m.count
+        cov_dy = m.sum_dy / m.count - np.outer(m.sum_d / m.count, m.sum_y / m.count)
+        scale = np.sqrt(np.maximum(np.diag(cov_dd), 1e-300))
+        return np.linalg.lstsq(cov_dd / np.outer(scale, scale), cov_dy / scale[:, None], rcond=None)[0] / scale[:, None]
+
+    def _use_cv(self):
+        return self.control_variate and self.m1.sum_d is not None
+
+    def estimates(self):
+        # (生存率 0〜1, 最終資産の平均)。制御変量ありなら補正後の値
+        est = self.m1.sum_y / self.n
+        if self._use_cv():
+            est = est - (self.m1.sum_d / self.n) @ self._beta()
+        return float(np.clip(est[0], 0, 1)), float(max(est[1], 0))
+
+    def variance_reduction(self):
+        # 推定量ごとの分散低減率 {"survival": 倍率, "mean_final": 倍率}。見積もれないものは None
+        out = dict.fromkeys(TARGETS)
+        if self.n < 2: return out
+        beta = self._beta() if self._use_cv() else None
+        var_plain = self.m1.variance()
+        if self.method == "plain":
+            var_est = self.m1.variance(beta)
+        elif self.mg.count >= MIN_GROUPS:
+            # グループ平均の分散 × グループの大きさ が、1本あたりの分散に相当する
+            var_est = self.mg.variance(beta) * self.mg.count / (self.mg.count - 1) * self.group_size
+        else:
+            return out
+        for i, key in enumerate(TARGETS):
+            if var_plain[i] > 0 and var_est[i] > 0:
+                out[key] = float(var_plain[i] / var_est[i])
+        return out
+
+class _Moments:
+    # Y (件数, 2) と制御変量 D (件数, k) の和・積和。足し算でマージできる
+    def __init__(self):
+        self.count = 0
+        self.sum_y = np.zeros(2)
+        self.sum_yy = np.zeros(2)
+        self.sum_d = None
+        self.sum_dd = None
+        self.sum_dy = None
+
+    def add(self, y, d=None):
+        self.count += len(y)
+        self.sum_y += y.sum(axis=0)
+        self.sum_yy += (y * y).sum(axis=0)
+        if d is not None:
+            if self.sum_d is None:
+                k = d.shape[1]
+                self.sum_d, self.sum_dd, self.sum_dy = np.zeros(k), np.zeros((k, k)), np.zeros((k, 2))
+            self.sum_d += d.sum(axis=0)
+            self.sum_dd += d.T @ d
+            self.sum_dy += d.T @ y
+
+    def merge(self, other):
+        self.count += other.count
+        self.sum_y += other.sum_y
+        self.sum_yy += other.sum_yy
+        if other.sum_d is not None:
+            if self.sum_d is None:
+                self.sum_d, self.sum_dd, self.sum_dy = other.sum_d.copy(), other.sum_dd.copy(), other.sum_dy.copy()
+            else:
+                self.sum_d += other.sum_d
+                self.sum_dd += other.sum_dd
+                self.sum_dy += other.sum_dy
+
+    def variance(self, beta=None):
+        # Y - Dβ の分散 (beta=None なら Y そのものの分散)
+        n = self.count
+        mean = self.sum_y / n
+        second = self.sum_yy / n
+        if beta is not None:
+            mean = mean - (self.sum_d / n) @ beta
+            second = (second - 2 * (beta * self.sum_dy).sum(axis=0) / n
+                      + np.einsum("ki,kl,li->i", beta, self.sum_dd / n, beta))
+        return second - mean * mean
@@ -0,0 +1,55 @@
+import math
+from statistics import NormalDist
+
+import numpy as np
+
+# ==========================================
+# ▼ 推定精度 (信頼区間) ▼
+# ==========================================
+def z_value(confidence=0.95):
+    return NormalDist().inv_cdf(0.5 + confidence / 2)
+
+def survival_interval(survivors, n, confidence=0.95):
+    # 生存率 (%) の Wilson スコア区間。生存率が 100% 近くでも幅が潰れない
+    if n == 0: return (0.0, 100.0)
+    z = z_value(confidence)
+    p = survivors / n
+    denom = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denom
+    half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denom
+    return (max(center - half, 0.0) * 100, min(center + half, 1.0) * 100)
+
+def median_rank_interval(n, confidence=0.95):
+    # 中央値の分布によらない信頼区間を与える順位 (0始まり)。二項分布の正規近似
+    z = z_value(confidence)
+    lo = math.floor(n / 2 - z * math.sqrt(n) / 2)
+    hi = math.ceil(n / 2 + z * math.sqrt(n) / 2)
+    return (min(max(lo, 0), n - 1), min(max(hi, 0), n - 1))
+
+def final_values_at_ranks(agg, ranks):
+    # 最終年の値を小さい順で ranks 番目に並べたときの値 (agg はパス行列か PathSketch)
+    if isinstance(agg, np.ndarray):
+        final = np.partition(agg[:, -1], ranks)
+        return [float(final[r]) for r in ranks]
+    return [float(agg.value_at_rank(np.full(agg.num_points, r, dtype=float))[-1]) for r in ranks]
+
+def effective_paths(num_paths, variance_reduction=None):
+    # 分散低減の効果を、同じ精度を出すのに必要な通常サンプリングのパス数に換算する
+    return num_paths * variance_reduction if variance_reduction else num_paths
+
+def precision_summary(agg, num_paths, survival_rate, confidence=0.95, variance_reduction=None):
+    # survival_rate は % 。生存率の区間は分散低減後の実効パス数で計算する
+    lo, hi = median_rank_interval(num_paths, confidence)
+    n_eff = effective_paths(num_paths, variance_reduction)
+    return {
+        "survival_ci": survival_interval(survival_rate / 100 * n_eff, n_eff, confidence),
+        "median_ci": tuple(final_values_at_ranks(agg, [lo, hi])),
+    }
+
+def precision_met(summary, median, survival_pp=None, median_pct=None):
+    # 生存率は ±survival_pp ポイント、最終中央値は ±median_pct % 以内なら達成
+    s_lo, s_hi = summary["survival_ci"]
+    if survival_pp is not None and (s_hi - s_lo) / 2 > survival_pp: return False
+    m_lo, m_hi = summary["median_ci"]
+    if median_pct is not None and (m_hi - m_lo) / 2 > abs(median) * median_pct / 100: return False
+    return True
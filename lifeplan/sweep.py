@@ -0,0 +1,71 @@
+import numpy as np
+
+from .core import prepare_run
+from .sampling import draw_returns
+
+# ==========================================
+# ▼ 感応度スイープ (利回り × リスク × インフレ率) ▼
+# ==========================================
+# 全セルで同じ標準正規乱数 z を使い (共通乱数法)、リターン = 実質平均 + 標準偏差 × z と
+# ずらして伸ばすだけにする。隣り合うセルの差には乱数のばらつきが乗らず、条件の差だけが出る。
+# インフレ率は実質平均 (利回り - インフレ率) にしか効かないので、実質平均が同じセルは1回だけ計算する。
+
+# 一度に進める (セル数 × 試行回数) の目安。途中の推移は持たず、作業用配列がキャッシュに収まる大きさにする
+SWEEP_BATCH_ELEMENTS = 2 ** 17
+
+def final_assets(initial_assets, flows, spots, means, stds, z_by_year):
+    # (セル数, 試行回数) の最終資産。全セル・全パスを年ごとにまとめて進める
+    # 破綻のルールは run_monte_carlo と同じ (0 になったら以降も 0、マイナスは 0 に切り上げ)
+    wealth = np.full((len(means), z_by_year.shape[1]), float(initial_assets))
+    growth = np.empty_like(wealth)
+    dead = np.empty(wealth.shape, dtype=bool)
+    one_plus_means, stds = 1 + np.asarray(means)[:, None], np.asarray(stds)[:, None]
+    for y in range(len(flows)):
+        np.less_equal(wealth, 0, out=dead)
+        np.multiply(stds, z_by_year[y], out=growth)
+        growth += one_plus_means
+        wealth += flows[y] + spots[y]
+        wealth *= growth
+        np.maximum(wealth, 0, out=wealth)
+        np.copyto(wealth, 0, where=dead)
+    return wealth
+
+def sweep_grid(scenario, mean_returns_pct, risk_stds_pct, inflations_pct=None):
+    # 各軸の値の組み合わせごとの生存率 (%) と最終資産の中央値を (利回り, リスク, インフレ率) の配列で返す
+    # 1つの資産・正規分布・年単位で計算するので、本体の利回りモデルなどの設定は使わない
+    s, _, plan = prepare_run({**scenario, "return_model": "normal", "model_params": None, "portfolio": None,
+                              "time_step": "year", "control_variate": False})
+    if inflations_pct is None: inflations_pct = [s["inflation_rate_pct"]]
+    mean_returns_pct, risk_stds_pct, inflations_pct = (np.asarray(a, dtype=float) for a in (mean_returns_pct, risk_stds_pct, inflations_pct))
+
+    flows, spots = plan["flows"], plan["spots"]
+    num_paths = s["num_simulations"]
+    # 共通の標準正規乱数 (年, 試行回数)。サンプリング方式は本体と同じものを使える
+    z = draw_returns(np.random.default_rng(s["seed"]), {"flows": flows, "mean": 0.0, "std": 1.0, "sampling": s["sampling"]}, num_paths)
+    z_by_year = np.ascontiguousarray(z.T)
+
+    # (実質平均, リスク) の組ごとに計算し、インフレ率の軸へは展開するだけ (丸めて浮動小数の誤差の差を同一視)
+    real_means, inverse = np.unique(np.round((mean_returns_pct[:, None] - inflations_pct[None, :]) / 100, 12), return_inverse=True)
+    cell_means = np.repeat(real_means, len(risk_stds_pct))
+    cell_stds = np.tile(risk_stds_pct / 100, len(real_means))
+    survival = np.empty(len(cell_means))
+    median_final = np.empty(len(cell_means))
+    batch = max(1, SWEEP_BATCH_ELEMENTS // num_paths)
+    for start in range(0, len(cell_means), batch):
+        cells = slice(start, start + batch)
+        final = final_assets(s["current_assets"], flows, spots, cell_means[cells], cell_stds[cells], z_by_year)
+        survival[cells] = (final > 0).mean(axis=1) * 100
+        median_final[cells] = np.median(final, axis=1)
+
+    # (実質平均, リスク) -> (利回り, インフレ率, リスク) -> (利回り, リスク, インフレ率)
+    shape = (len(mean_returns_pct), len(inflations_pct), len(risk_stds_pct))
+    expand = lambda v: v.reshape(len(real_means), len(risk_stds_pct))[inverse.reshape(shape[:2])].transpose(0, 2, 1)
+    return {
+        "mean_returns_pct": mean_returns_pct,
+        "risk_stds_pct": risk_stds_pct,
+        "inflations_pct": inflations_pct,
+        "survival": expand(survival),
+        "median_final": expand(median_final),
+        "num_paths": num_paths,
+        "end_age": s["current_age"] + len(flows),
+    }
@@ -0,0 +1,139 @@
+import numpy as np
+
+# ==========================================
+# ▼ 教育費データ（年額・万円） ▼
+# ==========================================
+EDU_COSTS = {
+    "all_public": { "kindergarten": 23, "elementary": 35, "junior_high": 54, "high_school": 52, "university": 120 },
+    "private_uni": { "kindergarten": 23, "elementary": 35, "junior_high": 54, "high_school": 52, "university": 172 },
+    "all_private": { "kindergarten": 36, "elementary": 170, "junior_high": 144, "high_school": 105, "university": 172 },
+    "vocational": { "kindergarten": 23, "elementary": 35, "junior_high": 54, "high_school": 52, "vocational_school": 130 },
+    "junior_college": { "kindergarten": 23, "elementary": 35, "junior_high": 54, "high_school": 52, "junior_college": 120 },
+    "high_school_grad": { "kindergarten": 23, "elementary": 35, "junior_high": 54, "high_school": 52 },
+    "medical_private": { "kindergarten": 36, "elementary": 170, "junior_high": 144, "high_school": 105, "medical_uni": 500 },
+    "study_abroad": { "kindergarten": 36, "elementary": 170, "junior_high": 144, "high_school": 105, "overseas_uni": 700 }
+}
+
+def get_school_stage(age, course_type):
+    if 3 <= age <= 5: return "kindergarten"
+    if 6 <= age <= 11: return "elementary"
+    if 12 <= age <= 14: return "junior_high"
+    if 15 <= age <= 17: return "high_school"
+
+    # 18歳以降の分岐
+    if 18 <= age <= 23 and course_type == "medical_private": return "medical_uni"
+    if 18 <= age <= 21:
+        if course_type in ["all_public", "private_uni", "all_private"]: return "university"
+        if course_type == "study_abroad": return "overseas_uni"
+    if 18 <= age <= 19:
+        if course_type == "vocational": return "vocational_school"
+        if course_type == "junior_college": return "junior_college"
+
+    return None
+
+STAGE_NAMES = {
+    "kindergarten": "幼", "elementary": "小", "junior_high": "中",
+    "high_school": "高", "university": "大", "vocational_school": "専", "junior_college": "短",
+    "medical_uni": "医", "overseas_uni": "留"
+}
+
+# ==========================================
+# ▼ 年齢×コースの学校段階・学費テーブル ▼
+# ==========================================
+# get_school_stage の if 連鎖を起動時に1度だけ評価して配列にしておく
+COURSE_KEYS = list(EDU_COSTS.keys())
+STAGE_KEYS = list(STAGE_NAMES.keys())
+MAX_CHILD_AGE = 100
+NO_STAGE = -1
+
+STAGE_TABLE = np.full((len(COURSE_KEYS), MAX_CHILD_AGE + 1), NO_STAGE, dtype=np.int8)
+COST_TABLE = np.zeros((len(COURSE_KEYS), MAX_CHILD_AGE + 1), dtype=np.int64)
+for _c, _course in enumerate(COURSE_KEYS):
+    for _age in range(MAX_CHILD_AGE + 1):
+        _stage = get_school_stage(_age, _course)
+        if _stage:
+            STAGE_TABLE[_c, _age] = STAGE_KEYS.index(_stage)
+            COST_TABLE[_c, _age] = EDU_COSTS[_course][_stage]
+
+def get_end_age(scenario):
+    return scenario["phases_list"][-1]["end"] if scenario["phases_list"] else 100
+
+# ==========================================
+# ▼ 収支タイムライン ▼
+# ==========================================
+def compile_timeline(scenario):
+    # シナリオを「現在の年齢からの経過年」(0〜years) で引ける配列の辞書に変換する
+    #   net_flow : その年の収支 (期間収支 - 教育費 + 年金 + 住宅) ※イベントは含まない
+    #   spot     : その年のイベント (一時金) 合計
+    #   spot_month : (years+1, 12) イベントを月ごとに分けたもの
+    #   edu_cost / edu_stage / child_age : (子供の数, years+1)。段階なしは NO_STAGE
+    #   loan_mask / pension_mask : ローン返済中 / 年金受給中 の年
+    current_age = scenario["current_age"]
+    end_age = get_end_age(scenario)
+    years = end_age - current_age
+    ages = np.arange(current_age, current_age + max(years, 0) + 1)
+    n = len(ages)
+    housing_info = scenario["housing_info"]
+
+    # 1. 期間ごとの収支 (各期間は前の期間の翌年から)
+    base_flow = np.zeros(n)
+    temp_start = current_age
+    for p in scenario["phases_list"]:
+        end_val = int(p["end"])
+        lo, hi = temp_start - current_age, end_val - current_age + 1
+        if temp_start <= end_val and hi > 0 and lo < n:
+            base_flow[max(lo, 0):hi] = int(p["amount"])
+        temp_start = end_val + 1
+
+    # 2. 教育費 (子供ごとの年齢 -> テーブル参照)
+    children = scenario["children_list"]
+    child_age = np.array([[int(c["age"])] for c in children], dtype=np.int64).reshape(len(children), 1) + np.arange(n)
+    course_idx = np.array([COURSE_KEYS.index(c["course"]) for c in children], dtype=np.int64)[:, None]
+    in_table = (child_age >= 0) & (child_age <= MAX_CHILD_AGE)
+    lookup_age = np.clip(child_age, 0, MAX_CHILD_AGE)
+    edu_stage = np.where(in_table, STAGE_TABLE[course_idx, lookup_age], NO_STAGE)
+    edu_cost = np.where(in_table, COST_TABLE[course_idx, lookup_age], 0)
+    edu_total = edu_cost.sum(axis=0)
+
+    # 3. 年金 & 住宅ローン
+    pension_mask = (ages >= scenario["pension_start_age"]) if scenario["use_pension"] else np.zeros(n, dtype=bool)
+    htype = housing_info["type"]
+    if htype == "none":
+        loan_mask = np.zeros(n, dtype=bool)
+    else:
+        loan_mask = (ages >= housing_info["start_age"]) & (ages <= housing_info["end_age"])
+
+    # 加算の順序は旧来の辞書版と同じ (浮動小数点の結果を一致させるため)
+    net_flow = base_flow - edu_total
+    net_flow = net_flow + np.where(pension_mask, scenario["pension_annual"], 0)
+    if htype == "already":
+        net_flow = net_flow + np.where(ages > housing_info["end_age"], housing_info["annual_pmt"], 0)
+    elif htype == "future":
+        bought = ages >= housing_info["start_age"]
+        net_flow = net_flow + np.where(bought, housing_info["current_rent_saved"], 0)
+        net_flow = net_flow - np.where(bought & loan_mask, housing_info["annual_pmt"], 0)
+
+    # 4. イベント (月次計算では month (1〜12, 既定は1か月目) の月に入れる)
+    spot = np.zeros(n)
+    spot_month = np.zeros((n, 12))
+    for e in scenario["events_list"]:
+        y = int(e["age"]) - current_age
+        month = int(e.get("month", 1))
+        if not 1 <= month <= 12: raise ValueError(f"イベントの月は 1〜12 で指定してください: {month}")
+        if 0 <= y < n:
+            spot[y] += int(e["amount"])
+            spot_month[y, month - 1] += int(e["amount"])
+
+    return {
+        "ages": ages,
+        "base_flow": base_flow,
+        "net_flow": net_flow,
+        "spot": spot,
+        "spot_month": spot_month,
+        "child_age": child_age,
+        "edu_stage": edu_stage,
+        "edu_cost": edu_cost,
+        "edu_total": edu_total,
+        "loan_mask": loan_mask,
+        "pension_mask": pension_mask,
+    }
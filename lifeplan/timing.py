@@ -0,0 +1,103 @@
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import sys
+import time
+from collections import OrderedDict
+
+# ==========================================
+# ▼ 処理段階ごとの計測 ▼
+# ==========================================
+# with stage("monte_carlo"): ... で囲んだ区間の経過時間を、有効な StageTimer に積み上げる。
+# StageTimer が有効でないとき (通常の実行) は何もしないので、計算側はいつ呼んでもよい。
+# 有効にする範囲は timer.activate() で決める (スレッド・非同期タスクごとに独立)。
+#
+# 構造化ログ: StageTimer.log() は1回の実行を JSON 1行にして "lifeplan.timing" ロガーに INFO で出す。
+# 環境変数 LIFEPLAN_TIMING_LOG に "-" (標準エラー) かファイルパスを指定すると、その出力先に書き出す。
+TIMING_LOG = os.environ.get("LIFEPLAN_TIMING_LOG")
+
+logger = logging.getLogger("lifeplan.timing")
+
+_current = contextvars.ContextVar("lifeplan_stage_timer", default=None)
+
+# 表示・ログで使う段階名
+STAGE_LABELS = {
+    "timeline": "収支の年表",
+    "plan": "計算の準備 (利回りモデル)",
+    "monte_carlo": "モンテカルロ",
+    "summarize": "パーセンタイル・分布表",
+    "precision": "信頼区間",
+    "chart": "グラフ描画",
+    "table": "表の作成・送信",
+}
+
+class StageTimer:
+    def __init__(self):
+        self.seconds = OrderedDict()
+        self.calls = OrderedDict()
+
+    def add(self, name, seconds):
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def merge(self, other):
+        for name, sec in other.seconds.items():
+            self.seconds[name] = self.seconds.get(name, 0.0) + sec
+            self.calls[name] = self.calls.get(name, 0) + other.calls[name]
+        return self
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        # この StageTimer に直接積み上げる (activate していない場所で使う)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    @contextlib.contextmanager
+    def activate(self):
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    def total(self):
+        return sum(self.seconds.values())
+
+    def rows(self):
+        # [(段階名, 表示名, 秒, 回数), ...] (計測した順)
+        return [(name, STAGE_LABELS.get(name, name), sec, self.calls[name]) for name, sec in self.seconds.items()]
+
+    def log(self, **context):
+        # 1回分の計測を JSON 1行で出す。context には試行回数などの付帯情報を入れる
+        _configure_log()
+        record = {"event": "stage_timing", **context,
+                  "stages_ms": {name: round(sec * 1000, 3) for name, sec in self.seconds.items()},
+                  "total_ms": round(self.total() * 1000, 3)}
+        logger.info(json.dumps(record, ensure_ascii=False))
+        return record
+
+@contextlib.contextmanager
+def stage(name):
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    with timer.measure(name):
+        yield
+
+_log_configured = False
+
+def _configure_log():
+    global _log_configured
+    if _log_configured or not TIMING_LOG: return
+    _log_configured = True
+    handler = logging.StreamHandler(sys.stderr) if TIMING_LOG == "-" else logging.FileHandler(TIMING_LOG, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False